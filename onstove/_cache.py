@@ -0,0 +1,179 @@
+import os
+import hashlib
+import pickle
+import tempfile
+import types
+from typing import Optional, Any
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from onstove.layer import VectorLayer, RasterLayer
+
+
+class RasterCache:
+    """On-disk cache of derived raster datasets.
+
+    Every entry is identified by a hash of the content of its inputs (arrays, layers, grid metadata and operation
+    parameters), so any change in the inputs produces a new key. Cached arrays are stored as ``.npy`` files and read
+    back memory-mapped in copy-on-write mode, so in place edits of the returned arrays never modify the cache. When the
+    total size of the cache exceeds ``max_size``, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    directory: str
+        Folder where the cached rasters are stored.
+    max_size: int, default 10 GB
+        Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = 10 * 1024 ** 3):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _update(self, h: 'hashlib._Hash', item: Any, functions: Optional[set] = None):
+        # ``functions`` holds the functions being hashed, so recursive references are hashed only once
+        if functions is None:
+            functions = set()
+        if isinstance(item, RasterLayer):
+            self._update(h, item.data, functions)
+            self._update(h, {key: item.meta.get(key) for key in ['crs', 'transform', 'nodata', 'width', 'height']},
+                         functions)
+            # restricted areas change the travel time computed from or with the layer
+            self._update(h, getattr(item, 'restrictions', []), functions)
+        elif isinstance(item, VectorLayer):
+            self._update(h, item.data, functions)
+            self._update(h, getattr(item, 'restrictions', []), functions)
+        elif isinstance(item, gpd.GeoDataFrame):
+            h.update(str(item.crs).encode())
+            # geometries are hashed one by one, as a fixed width array would pad every row to the largest one
+            for wkb in shapely.to_wkb(item.geometry.values):
+                h.update(b'' if wkb is None else wkb)
+            attributes = pd.DataFrame(item.drop(columns=item.geometry.name))
+            try:
+                h.update(pd.util.hash_pandas_object(attributes).values.tobytes())
+            except TypeError:
+                h.update(attributes.astype(str).to_csv().encode())
+        elif isinstance(item, np.ndarray):
+            h.update(f'{item.dtype.str}{item.shape}'.encode())
+            h.update(np.ascontiguousarray(item).data)
+        elif isinstance(item, dict):
+            for key in sorted(item, key=str):
+                h.update(str(key).encode())
+                self._update(h, item[key], functions)
+        elif isinstance(item, (list, tuple)):
+            h.update(f'{type(item).__name__}{len(item)}'.encode())
+            for value in item:
+                self._update(h, value, functions)
+        elif isinstance(item, types.ModuleType):
+            h.update(item.__name__.encode())
+        elif callable(item) and hasattr(item, '__code__'):
+            # functions are identified by their bytecode, constants, captured values and referenced globals
+            h.update(item.__code__.co_code)
+            if item in functions:
+                return
+            functions.add(item)
+            self._update(h, [c for c in item.__code__.co_consts if not hasattr(c, 'co_code')], functions)
+            self._update(h, [cell.cell_contents for cell in (item.__closure__ or [])], functions)
+            referenced = getattr(item, '__globals__', {})
+            self._update(h, {name: referenced[name] for name in item.__code__.co_names if name in referenced},
+                         functions)
+        else:
+            h.update(repr(item).encode())
+
+    def key(self, *items: Any) -> str:
+        """Computes the cache key of the given inputs.
+
+        Parameters
+        ----------
+        items: any
+            Inputs identifying the derived raster, such as the name of the operation, the input layers, the base grid
+            metadata and the parameters of the operation.
+
+        Returns
+        -------
+        str
+            Hexadecimal digest identifying the inputs.
+        """
+        h = hashlib.sha1()
+        self._update(h, list(items))
+        return h.hexdigest()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.directory, key + '.npy'), os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key: str) -> Optional[tuple[np.ndarray, dict, str]]:
+        """Gets a cached raster.
+
+        Parameters
+        ----------
+        key: str
+            Key of the raster as given by :meth:`key`.
+
+        Returns
+        -------
+        tuple of np.ndarray, dict and str or None
+            The memory-mapped data, the metadata and the name of the raster, or None if the key is not cached.
+        """
+        data_path, info_path = self._paths(key)
+        try:
+            with open(info_path, 'rb') as f:
+                info = pickle.load(f)
+            data = np.asarray(np.load(data_path, mmap_mode='c'))
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        for path in [data_path, info_path]:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return data, info['meta'], info['name']
+
+    def put(self, key: str, data: np.ndarray, meta: dict, name: str = ''):
+        """Stores a raster in the cache and evicts the least recently used entries if needed.
+
+        Parameters
+        ----------
+        key: str
+            Key of the raster as given by :meth:`key`.
+        data: np.ndarray
+            Data of the raster.
+        meta: dict
+            Metadata of the raster.
+        name: str, default ''
+            Name of the raster.
+        """
+        data_path, info_path = self._paths(key)
+        # files are written under a temporary name first so concurrent readers never see partial entries
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            np.save(f, np.asarray(data))
+        os.replace(f.name, data_path)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            pickle.dump({'meta': dict(meta), 'name': name}, f)
+        os.replace(f.name, info_path)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in ``max_size``."""
+        entries = {}
+        for file in os.listdir(self.directory):
+            key, ext = os.path.splitext(file)
+            if ext not in ['.npy', '.pkl']:
+                continue
+            stat = os.stat(os.path.join(self.directory, file))
+            size, last_used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+            if total <= self.max_size:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
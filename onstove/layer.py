@@ -1,25 +1,41 @@
 """This module contains the GIS layer classes used in OnStove."""
 import os
+import hashlib
+import heapq
 
 import numpy as np
+import pandas as pd
 import geopandas as gpd
 import datetime
+import json
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import matplotlib.lines as mplines
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import time
+import threading
+import multiprocessing
+import uuid
 import shapely
 
 import pyproj
+import psycopg2
+import psycopg2.pool
+from psycopg2 import sql as psql
 import rasterio
 from rasterio import warp, features, windows, transform
 from matplotlib.colors import ListedColormap, to_rgb, to_hex
 from scipy import ndimage
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 from typing import Optional, Callable, Union
 from warnings import warn
 from copy import deepcopy
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from onstove.plotting_utils import scale_bar as scale_bar_func
 from onstove.plotting_utils import north_arrow as north_arrow_func
@@ -40,6 +56,14 @@ def try_import():
 MCP_Geometric = try_import()
 
 
+def _solve_cost_tile(layer: np.ndarray, sources: np.ndarray, limit: float) -> np.ndarray:
+    """Solves the cumulative costs of a tile of a cost surface from the ``sources`` costs (see
+    :meth:`RasterLayer._tiled_travel_time`)."""
+    graph = RasterLayer._cost_graph(layer, sources=sources)
+    costs = dijkstra(graph, directed=False, indices=graph.shape[0] - 1, limit=limit)
+    return costs[:-1].reshape(layer.shape)
+
+
 class _Layer:
     """Template Layer initializing all common needed attributes.
     """
@@ -57,6 +81,7 @@ class _Layer:
         self.inverse = inverse
         self.friction = None
         self.distance_raster = None
+        self.catchment = None
         self.restrictions = []
         self.weight = 1
         self.path = path
@@ -79,6 +104,44 @@ class _Layer:
 
     def read_layer(self, layer_path, conn=None):
         pass
+
+    def add_restricted_areas(self, layer: Union[str, 'VectorLayer', 'RasterLayer'], layer_type: str = 'vector',
+                             **kwargs):
+        """Adds restricted areas for the travel time calculations.
+
+        The cells covered by the restricted areas are considered impassable by the travel time methods. Vector layers
+        restrict every cell they touch, and raster layers every valid cell with a non-zero value. The restrictions are
+        rasterized once per grid and cached in the restriction layer.
+
+        Parameters
+        ----------
+        layer: str, VectorLayer or RasterLayer
+            Restricted areas layer, or path to the file to read it from.
+        layer_type: str, default 'vector'
+            Type of the file to read, either ``'vector'`` or ``'raster'``. Only used if a path is given.
+        **kwargs: dict, optional
+            Additional parameters used to create the layer if a path is given.
+        """
+        if isinstance(layer, (VectorLayer, RasterLayer)):
+            self.restrictions.append(layer)
+            return
+        i = len(self.restrictions) + 1
+        if layer_type == 'vector':
+            self.restrictions.append(VectorLayer(self.category,
+                                                 self.name + f' - restriction{i}',
+                                                 layer, **kwargs))
+        elif layer_type == 'raster':
+            self.restrictions.append(RasterLayer(self.category,
+                                                 self.name + f' - restriction{i}',
+                                                 layer, **kwargs))
+        else:
+            raise ValueError("The layer_type should be either 'vector' or 'raster'.")
+
+    @staticmethod
+    def _grid_key(raster: 'RasterLayer') -> tuple:
+        """Identifies the grid of a raster layer."""
+        meta = raster.meta
+        return str(meta['crs']), tuple(meta['transform'])[:6], meta['width'], meta['height']
     
     def copy(self):
         '''Wrapper class to the ``deepcopy`` function of the copy module. It creates a complete copy of the layer.
@@ -150,9 +213,10 @@ class VectorLayer(_Layer):
     path: str, optional
         The relative path to the datafile. This file can be of any type that is accepted by
         :doc:`geopandas:docs/reference/api/geopandas.read_file`.
-    conn: sqlalchemy.engine.Connection or sqlalchemy.engine.Engine, optional
-        PostgreSQL connection if the layer needs to be read from a database. This accepts any connection type used by
-        :doc:`geopandas:docs/reference/api/geopandas.read_postgis`.
+    conn: psycopg2 connection or connection pool, sqlalchemy.engine.Connection or sqlalchemy.engine.Engine, optional
+        PostgreSQL connection if the layer needs to be read from a database. psycopg2 connections and connection pools
+        are read in chunks with the ``bbox`` filter applied in the database, any other connection type used by
+        :doc:`geopandas:docs/reference/api/geopandas.read_postgis` reads the whole table.
 
         .. seealso::
            :meth:`read_layer` and :meth:`onstove.DataProcessor.set_postgres`
@@ -186,6 +250,8 @@ class VectorLayer(_Layer):
     bbox: tuple, gpd.GeoDataFrame, gpd.GeoSeries or shapely Geometry, optional
         Filter features by given bounding box, GeoSeries, GeoDataFrame or a shapely geometry. For more information
         refer to :doc:`geopandas:docs/reference/api/geopandas.read_file`.
+    columns: list of str, optional
+        Names of the columns to read. If not defined all columns are read.
 
     Attributes
     ----------
@@ -193,11 +259,12 @@ class VectorLayer(_Layer):
     distance_raster
         :class:`RasterLayer` object containing a distance raster dataset calculated by the :meth:`get_distance_raster`
         method using one of the ``distance`` methods.
+    catchment
+        :class:`RasterLayer` with the nearest starting point of each cell, calculated by :meth:`travel_time` when the
+        ``catchment`` option is used.
     restrictions
-        List of :class:`RasterLayer` or :class:`VectorLayer` used to restrict areas from the distance calculations.
-
-        .. warning::
-            The use of restrictions is under development and it will be available in future releases.
+        List of :class:`RasterLayer` or :class:`VectorLayer` used to restrict areas from the travel time calculations.
+        See :meth:`add_restricted_areas`.
 
     weight
         Value to weigh the layer's "importance" on the ``MCA`` model. It is initialized with a default value of 1.
@@ -220,17 +287,20 @@ class VectorLayer(_Layer):
                  inverse: bool = False,
                  distance_method:  Optional[str] = 'proximity',
                  distance_limit: Optional[Callable[[np.ndarray], np.ndarray]] = None,
-                 bbox: Optional[gpd.GeoDataFrame] = None):
+                 bbox: Optional[gpd.GeoDataFrame] = None,
+                 columns: Optional[list[str]] = None):
         """
         Initializes the class with user defined or default parameters.
         """
         self.style = {}
+        # the layer can be shared by threads (e.g. as mask layer of :meth:`onstove.DataProcessor.mask_layers`)
+        self._cache_lock = threading.Lock()
         super().__init__(category=category, name=name,
                          path=path, conn=conn,
                          normalization=normalization, inverse=inverse,
                          distance_method=distance_method,
                          distance_limit=distance_limit)
-        self.read_layer(path=path, conn=conn, bbox=bbox, query=query)
+        self.read_layer(path=path, conn=conn, bbox=bbox, query=query, columns=columns)
         if distance_method is None:
             self.distance_method = 'proximity'
 
@@ -240,6 +310,38 @@ class VectorLayer(_Layer):
     def __str__(self):
         return 'Vector' + super().__str__()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mask_geometry_cache'] = {}
+        state['_restriction_cache'] = {}
+        state.pop('_cache_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        # layers pickled before ``data`` became a property store the dataframe under ``data``
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        state.setdefault('_mask_geometry_cache', {})
+        state.setdefault('_restriction_cache', {})
+        state['_cache_lock'] = threading.Lock()
+        self.__dict__.update(state)
+
+    @property
+    def data(self) -> gpd.GeoDataFrame:
+        """:doc:`GeoDataFrame<geopandas:docs/reference/api/geopandas.GeoDataFrame>` containing the data of the vector
+        layer.
+
+        Setting a new dataframe resets the cached mask geometries and restriction masks. If the dataframe is modified in
+        place, reassign it with ``layer.data = layer.data`` to reset the cache.
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data: gpd.GeoDataFrame):
+        self._data = data
+        self._mask_geometry_cache = {}
+        self._restriction_cache = {}
+
     @property
     def bounds(self) -> list[float]:
         """Wrapper property to get the  west, south, east, north bounds of the dataset using the ``total_bounds``
@@ -247,51 +349,209 @@ class VectorLayer(_Layer):
         """
         return self.data.total_bounds
 
+    @staticmethod
+    def _bbox_box(bbox: gpd.GeoDataFrame) -> gpd.GeoSeries:
+        """Gets the bounding box of ``bbox`` as a densified polygon, so it can be reprojected without reprojecting all
+        the geometries.
+        """
+        minx, miny, maxx, maxy = bbox.total_bounds
+        box = shapely.segmentize(shapely.box(minx, miny, maxx, maxy), max(maxx - minx, maxy - miny) / 50)
+        return gpd.GeoSeries([box], crs=bbox.crs)
+
+    @staticmethod
+    def _read_parquet(path: str, bbox: Optional[gpd.GeoDataFrame] = None,
+                      columns: Optional[list[str]] = None) -> gpd.GeoDataFrame:
+        """Reads a GeoParquet file, loading only the requested ``columns`` and, if a ``bbox`` is given, only the
+        rows intersecting its bounding box.
+
+        If the file has a bounding box covering column (as written by :meth:`save`), the row groups outside the
+        ``bbox`` are skipped while reading. Otherwise the whole file is read and the rows are filtered with its spatial
+        index.
+        """
+        import pyarrow.parquet as pq
+
+        geo = json.loads(pq.read_schema(path).metadata[b'geo'])
+        geometry_column = geo['primary_column']
+        if columns is not None and geometry_column not in columns:
+            columns = list(columns) + [geometry_column]
+        if bbox is None:
+            return gpd.read_parquet(path, columns=columns)
+
+        # GeoParquet files without crs metadata are in OGC:CRS84 by definition
+        crs = geo['columns'][geometry_column].get('crs', 'OGC:CRS84')
+        box = VectorLayer._bbox_box(bbox)
+        if crs is not None:
+            box = box.to_crs(pyproj.CRS.from_user_input(crs))
+        bbox = tuple(box.total_bounds)
+        if 'covering' in geo['columns'][geometry_column]:
+            return gpd.read_parquet(path, columns=columns, bbox=bbox)
+        data = gpd.read_parquet(path, columns=columns)
+        return data.iloc[np.sort(data.sindex.query(shapely.box(*bbox)))].reset_index(drop=True)
+
+    @staticmethod
+    def _read_postgis(table: str, conn: Union['psycopg2.extensions.connection', 'psycopg2.pool.AbstractConnectionPool'],
+                      bbox: Optional[gpd.GeoDataFrame] = None, columns: Optional[list[str]] = None,
+                      geom_col: str = 'geom', chunk_size: int = 50000) -> gpd.GeoDataFrame:
+        """Reads a PostGIS table in chunks through a server side cursor.
+
+        Only the ``columns`` requested are selected and, if a ``bbox`` is given, only the rows whose geometry
+        intersects its bounding box are returned (filtered in the database with ``ST_Intersects``, which can use the
+        spatial index of the table). If a connection pool is given, a connection is taken from the pool and returned
+        to it after reading. The transaction of a connection given directly is not ended.
+        """
+        pool = conn if isinstance(conn, psycopg2.pool.AbstractConnectionPool) else None
+        connection = pool.getconn() if pool else conn
+        table_id = psql.Identifier(*table.split('.'))
+        geom_id = psql.Identifier(geom_col)
+        try:
+            with connection.cursor() as cur:
+                cur.execute(psql.SQL('SELECT ST_SRID({}) FROM {} LIMIT 1').format(geom_id, table_id))
+                row = cur.fetchone()
+            srid = row[0] if row else 0
+
+            if columns is None:
+                select = psql.SQL('*')
+            else:
+                select = psql.SQL(', ').join([psql.Identifier(c) for c in columns if c != geom_col] + [geom_id])
+            query = psql.SQL('SELECT {} FROM {}').format(select, table_id)
+            params = []
+            if (bbox is not None) and srid:
+                query += psql.SQL(' WHERE ST_Intersects({}, ST_MakeEnvelope(%s, %s, %s, %s, %s))').format(geom_id)
+                params = [float(v) for v in VectorLayer._bbox_box(bbox).to_crs(srid).total_bounds] + [srid]
+
+            chunks = []
+            # named cursors live in the session, so each read gets its own name
+            with connection.cursor(name=f'onstove_read_layer_{uuid.uuid4().hex}') as cur:
+                cur.itersize = chunk_size
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    names = [d[0] for d in cur.description]
+                    if not rows:
+                        break
+                    chunk = pd.DataFrame(rows, columns=names)
+                    chunk[geom_col] = shapely.from_wkb(chunk[geom_col].to_numpy())
+                    chunks.append(chunk)
+        finally:
+            # the cursors are closed on exit, the transaction of a connection given by the user is left untouched
+            if pool:
+                # ends the read-only transaction opened by the cursors before handing the connection back
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    pass
+                pool.putconn(connection)
+
+        if chunks:
+            data = pd.concat(chunks, ignore_index=True)
+        else:
+            data = pd.DataFrame({name: [] for name in names})
+            data[geom_col] = gpd.GeoSeries([])
+        return gpd.GeoDataFrame(data, geometry=geom_col, crs=srid if srid else None)
+
     def read_layer(self, path: str,
                    conn: Optional['sqlalchemy.engine.Connection'] = None,
                    bbox: Optional[gpd.GeoDataFrame] = None,
-                   query: Optional[str] = None):
+                   query: Optional[str] = None,
+                   columns: Optional[list[str]] = None,
+                   geom_col: str = 'geom'):
         """Reads a dataset from GIS vector data file.
 
-        It works as a wrapper method that will use either the :doc:`geopandas:docs/reference/api/geopandas.read_file`
-        function or the :doc:`geopandas:docs/reference/api/geopandas.read_postgis` function to read vector data and
-        store the output in the :attr:`data` attribute and the layer path in the ``path`` attribute.
+        It works as a wrapper method that will use either the :doc:`geopandas:docs/reference/api/geopandas.read_file`,
+        the :doc:`geopandas:docs/reference/api/geopandas.read_parquet` (for ``.parquet`` files) or the
+        :doc:`geopandas:docs/reference/api/geopandas.read_postgis` function to read vector data and store the output
+        in the :attr:`data` attribute and the layer path in the ``path`` attribute.
 
         Parameters
         ----------
         path: str, optional
             The relative path to the datafile. This file can be of any type that is accepted by
             :doc:`geopandas:docs/reference/api/geopandas.read_file`.
-        conn: sqlalchemy.engine.Connection or sqlalchemy.engine.Engine, optional
-            PostgreSQL connection if the layer needs to be read from a database. This accepts any connection type used by
-            :doc:`geopandas:docs/reference/api/geopandas.read_postgis`.
-        bbox: tuple, GeoDataFrame, GeoSeries or shapely Geometry, optional
-            Filter features by a given bounding box, GeoSeries, GeoDataFrame or a shapely geometry. For more information
-            refer to :doc:`geopandas:docs/reference/api/geopandas.read_file`.
+        conn: psycopg2 connection or connection pool, sqlalchemy.engine.Connection or sqlalchemy.engine.Engine, optional
+            PostgreSQL connection if the layer needs to be read from a database. With a psycopg2 connection or
+            connection pool (see :meth:`onstove.DataProcessor.set_postgres`) the table is streamed in chunks from a
+            server side cursor, selecting only the ``columns`` requested and the rows intersecting the ``bbox``. Any
+            other connection type used by :doc:`geopandas:docs/reference/api/geopandas.read_postgis` reads the whole
+            table.
+        bbox: GeoDataFrame, optional
+            Filter features by the bounding box of a GeoDataFrame. The filter is applied by the file reader or the
+            database, so only the features intersecting the bounding box are loaded. For more information refer to
+            :doc:`geopandas:docs/reference/api/geopandas.read_file`.
         query: str, optional
             A query string to filter the data. For more information refer to
             :doc:`pandas:reference/api/pandas.DataFrame.query`.
+        columns: list of str, optional
+            Names of the columns to read. If not defined all columns are read.
+        geom_col: str, default 'geom'
+            Name of the geometry column of the table when reading from a PostgreSQL database.
         """
         if path:
-            if conn:
+            if (bbox is not None) and not isinstance(bbox, gpd.GeoDataFrame):
+                raise ValueError('The `bbox` parameter should be of type GeoDataFrame or None, '
+                                 f'type {type(bbox)} was given')
+            if isinstance(conn, (psycopg2.extensions.connection, psycopg2.pool.AbstractConnectionPool)):
+                self.data = self._read_postgis(path, conn, bbox=bbox, columns=columns, geom_col=geom_col)
+            elif conn:
                 sql = f'SELECT * FROM {path}'
-                self.data = gpd.read_postgis(sql, conn)
+                self.data = gpd.read_postgis(sql, conn, geom_col=geom_col)
+            elif path.lower().endswith(('.parquet', '.geoparquet')):
+                self.data = self._read_parquet(path, bbox=bbox, columns=columns)
             else:
-                if isinstance(bbox, gpd.GeoDataFrame):
-                    bbox = bbox.dissolve()
-                elif bbox is not None:
-                    raise ValueError('The `bbox` parameter should be of type GeoDataFrame or None, '
-                                     f'type {type(bbox)} was given')
-                self.data = gpd.read_file(path, bbox=bbox)
+                if bbox is not None:
+                    # only the bounds are used by the reader, so a densified box is reprojected instead of the full
+                    # geometries
+                    bbox = self._bbox_box(bbox)
+                self.data = gpd.read_file(path, bbox=bbox, columns=columns)
 
             if query:
                 self.data = self.data.query(query)
         self.path = path
 
+    def _mask_geometry(self, crs: Union[pyproj.CRS, int]) -> shapely.Geometry:
+        """Gets the union of all geometries of the layer in the given ``crs``.
+
+        The result is cached, so masking several layers with the same :class:`VectorLayer` dissolves it only once. The
+        cache is reset when the :attr:`data` of the layer changes.
+        """
+        key = (len(self.data), str(self.data.crs), str(crs))
+        with self._cache_lock:
+            cache = self._mask_geometry_cache
+            if key not in cache:
+                if any(k[:2] != key[:2] for k in cache):
+                    cache.clear()
+                cache[key] = shapely.union_all(self.data.to_crs(crs).geometry.values)
+            return cache[key]
+
+    def _restriction_mask(self, raster: 'RasterLayer') -> np.ndarray:
+        """Gets a boolean array flagging the cells of the grid of ``raster`` touched by the layer.
+
+        The result is cached per grid, and the cache is reset when the :attr:`data` of the layer changes.
+        """
+        key = (len(self.data), str(self.data.crs)) + self._grid_key(raster)
+        with self._cache_lock:
+            cache = self._restriction_cache
+            if key not in cache:
+                if any(k[:2] != key[:2] for k in cache):
+                    cache.clear()
+                geometry = self.data.geometry
+                if self.data.crs != raster.meta['crs']:
+                    geometry = geometry.to_crs(raster.meta['crs'])
+                geometry = geometry[geometry.notna() & ~geometry.is_empty]
+                if len(geometry) == 0:
+                    cache[key] = np.zeros((raster.meta['height'], raster.meta['width']), dtype=bool)
+                else:
+                    cache[key] = features.rasterize(((geom, 1) for geom in geometry.values),
+                                                    out_shape=(raster.meta['height'], raster.meta['width']),
+                                                    transform=raster.meta['transform'],
+                                                    fill=0, all_touched=True, dtype='uint8').astype(bool)
+            return cache[key]
+
     def mask(self, mask_layer: 'VectorLayer', output_path: str = None, keep_geom_type=False):
         """Wrapper for the :doc:`geopandas:docs/reference/api/geopandas.GeoDataFrame.clip` method.
 
-        Clip points, lines, or polygon geometries to the mask extent.
+        Clip points, lines, or polygon geometries to the mask extent. The spatial index of the layer is used to find
+        the features that intersect the mask; features fully within the mask are kept as they are and only the ones
+        crossing its boundary are clipped.
 
         Parameters
         ----------
@@ -303,7 +563,16 @@ class VectorLayer(_Layer):
             Determines whether single geometries are split in case of intersection during masking.
 
         """
-        self.data = gpd.clip(self.data, mask_layer.data.to_crs(self.data.crs), keep_geom_type=keep_geom_type)
+        geometry = mask_layer._mask_geometry(self.data.crs)
+        intersects = self.data.sindex.query(geometry, predicate='intersects')
+        within = self.data.sindex.query(geometry, predicate='contains')
+        boundary = np.setdiff1d(intersects, within)
+
+        position = '__position'
+        clipped = gpd.clip(self.data.iloc[boundary].assign(**{position: boundary}), geometry,
+                           keep_geom_type=keep_geom_type)
+        data = pd.concat([self.data.iloc[within].assign(**{position: within}), clipped])
+        self.data = data.sort_values(position, kind='stable').drop(columns=position)
         if isinstance(output_path, str):
             self.save(output_path)
 
@@ -319,7 +588,7 @@ class VectorLayer(_Layer):
             A folder path where to save the output dataset. If not defined then the reprojected dataset is not saved.
         """
         if self.data.crs != crs:
-            self.data.to_crs(crs, inplace=True)
+            self.data = self.data.to_crs(crs)
         if isinstance(output_path, str):
             self.save(output_path)
 
@@ -353,20 +622,7 @@ class VectorLayer(_Layer):
         --------
         get_distance_raster
         """
-        if isinstance(base_layer, str):
-            with rasterio.open(base_layer) as src:
-                width = src.width
-                height = src.height
-                transform = src.transform
-        elif isinstance(base_layer, RasterLayer):
-            width = base_layer.meta['width']
-            height = base_layer.meta['height']
-            transform = base_layer.meta['transform']
-        else:
-            raise ValueError('The `base_layer` (or `raster` if you are using the `get_distance_raster` method) '
-                             'must be either a raster file path or a '
-                             f'RasterLayer object. {type(base_layer)} was given instead.')
-
+        width, height, transform = self._base_grid(base_layer)
         rasterized = self.rasterize(value=1, width=width, height=height,
                                     transform=transform)
 
@@ -392,14 +648,75 @@ class VectorLayer(_Layer):
         else:
             return distance_raster
 
+    @staticmethod
+    def _base_grid(base_layer: Union[str, 'RasterLayer']) -> tuple[int, int, 'AffineTransform']:
+        """Returns the width, height and transform of the grid of a raster file path or :class:`RasterLayer`."""
+        if isinstance(base_layer, str):
+            with rasterio.open(base_layer) as src:
+                return src.width, src.height, src.transform
+        elif isinstance(base_layer, RasterLayer):
+            return base_layer.meta['width'], base_layer.meta['height'], base_layer.meta['transform']
+        raise ValueError('The `base_layer` (or `raster` if you are using the `get_distance_raster` method) '
+                         'must be either a raster file path or a '
+                         f'RasterLayer object. {type(base_layer)} was given instead.')
+
+    def proximity_at(self, base_layer: Union[str, 'RasterLayer'], rows: np.ndarray, cols: np.ndarray,
+                     max_distance: Optional[float] = None) -> np.ndarray:
+        """Calculates the euclidean proximity distance to the vector layer only for the given cells of a grid.
+
+        It gives the same distances as :meth:`proximity` (between the centers of the cells and the nearest cell
+        touched by the vector layer), but instead of computing a distance transform over the whole grid, it queries a
+        KD-tree of the cells touched by the layer from the requested cells only, such as the populated cells stored in
+        :attr:`OnStove.rows` and :attr:`OnStove.cols`.
+
+        Parameters
+        ----------
+        base_layer: str or RasterLayer
+            Raster layer (or path to a raster file) defining the grid of the ``rows`` and ``cols``.
+        rows: np.ndarray
+            Row indexes of the cells where to calculate the distance.
+        cols: np.ndarray
+            Column indexes of the cells where to calculate the distance.
+        max_distance: float, optional
+            Maximum distance to search for, in the units of the grid. Cells farther away from the layer get a distance
+            of `np.inf`. If not defined, the distances are not bounded.
+
+        Returns
+        -------
+        np.ndarray
+            Float32 array with the distance of every requested cell to the nearest cell touched by the layer.
+
+        See also
+        --------
+        proximity
+        """
+        width, height, transform = self._base_grid(base_layer)
+        rasterized = self.rasterize(value=np.uint8(1), width=width, height=height, transform=transform)
+        feature_rows, feature_cols = np.nonzero(rasterized.data)
+        rows = np.asarray(rows)
+        if len(feature_rows) == 0:
+            return np.full(rows.shape, np.inf, dtype='float32')
+
+        sampling = np.array([-transform[4], transform[0]])
+        tree = cKDTree(np.column_stack([feature_rows, feature_cols]) * sampling)
+        # the upper bound of the query is exclusive, so it is moved to the next float to include ``max_distance``
+        bound = np.inf if max_distance is None else np.nextafter(max_distance, np.inf)
+        distances, _ = tree.query(np.column_stack([rows, np.asarray(cols)]) * sampling,
+                                  distance_upper_bound=bound, workers=-1)
+        return distances.astype('float32')
+
     def travel_time(self, friction: Optional['RasterLayer'] = None,
                     output_path: Optional[str] = None,
-                    create_raster: Optional[bool] = True) -> 'RasterLayer':
+                    create_raster: Optional[bool] = True,
+                    catchment: bool = False,
+                    restrictions: Optional[list[Union['VectorLayer', 'RasterLayer']]] = None
+                    ) -> Union['RasterLayer', tuple['RasterLayer', 'RasterLayer']]:
         """Creates a travel time map to the nearest polygon in the layer using a friction surface.
 
         It calculates the minimum time needed to travel to the nearest point defined by the current :class:`VectorLayer`
         using a surface friction :class:`RasterLayer`. The friction dataset, describes how much time, in minutes, is
-        needed to travel one meter across each cell over the region.
+        needed to travel one meter across each cell over the region. Points, lines and polygons can be used, the
+        starting cells are found with the :meth:`start_points` method.
 
         Parameters
         ----------
@@ -410,18 +727,26 @@ class VectorLayer(_Layer):
         create_raster: bool, default True
             Boolean condition. If `True`, a :class:`RasterLayer` will be created and stored in the ``distance_raster``
             attribute of the class. If `False`, a :class:`RasterLayer` with the travel time calculation is returned.
+        catchment: bool, default False
+            Whether to also get the catchment of every feature, i.e. an int32 raster with the position in :attr:`data`
+            of the nearest feature of each cell (in travel time), or -1 where no feature is reached. It is obtained
+            from the same solve (see :meth:`RasterLayer.travel_time`). If ``create_raster`` is `True` it is stored in
+            the ``catchment`` attribute, otherwise it is returned along with the travel time.
+        restrictions: list of VectorLayer or RasterLayer, optional
+            Restricted areas that can not be traveled across (see :meth:`add_restricted_areas`). If not defined, the
+            :attr:`restrictions` of both the layer and the friction layer are used.
 
         Returns
         -------
-        RasterLayer
-            :class:`RasterLayer` with the travel time to the nearest polygon in the current :class:`VectorLayer`.
+        RasterLayer or tuple of RasterLayer
+            :class:`RasterLayer` with the travel time to the nearest polygon in the current :class:`VectorLayer`, and
+            the catchment :class:`RasterLayer` if ``catchment`` is `True`.
 
         Notes
         -----
         For more information on surface friction layers see the
         `Malarian Atlas Project <https://malariaatlas.org/explorer>`_.
         """
-        # TODO: it would be good if this worked for all vector types
         if not isinstance(friction, RasterLayer):
             if not isinstance(self.friction, RasterLayer):
                 raise ValueError('A friction `RasterLayer` is needed to calculate the travel time distance raster. '
@@ -431,14 +756,31 @@ class VectorLayer(_Layer):
             else:
                 friction = self.friction
 
-        rows, cols = self.start_points(raster=friction)
+        if restrictions is None:
+            restrictions = self.restrictions + friction.restrictions
+
+        cells, ids = self._start_cells(friction, feature_ids=catchment)
+        rows, cols = cells // friction.meta['width'], cells % friction.meta['width']
         distance_raster = friction.travel_time(rows=rows, cols=cols,
-                                             output_path=None, create_raster=False)
+                                             output_path=None, create_raster=False, catchment=catchment,
+                                             restrictions=restrictions)
+        if catchment:
+            distance_raster, catchment_raster = distance_raster
+            labels = catchment_raster.data
+            catchment_raster.data = np.where(labels >= 0, ids[labels], -1).astype('int32')
+            catchment_raster.name = self.name + '_catchment'
+
         if output_path:
             distance_raster.save(output_path)
+            if catchment:
+                catchment_raster.save(output_path)
 
         if create_raster:
             self.distance_raster = distance_raster
+            if catchment:
+                self.catchment = catchment_raster
+        elif catchment:
+            return distance_raster, catchment_raster
         else:
             return distance_raster
 
@@ -489,7 +831,9 @@ class VectorLayer(_Layer):
                   cell_height: Union[int, float] = None,
                   nodata: Union[int, float] = 0,
                   all_touched: bool = True,
-                  output_path: Optional[str] = None) -> 'RasterLayer':
+                  output_path: Optional[str] = None,
+                  tile_size: Optional[int] = None,
+                  workers: Optional[int] = None) -> 'RasterLayer':
         """Converts the vector data into a gridded raster dataset.
 
         It rasterizes the vector data by taking either a transform, the width and height of the image, or the cell
@@ -497,6 +841,11 @@ class VectorLayer(_Layer):
         :doc:`rasterio.features.rasterize<rasterio:api/rasterio.features>`
         function.
 
+        For very large layers a ``tile_size`` can be defined. Then the output grid is split into square tiles and
+        only the geometries intersecting each tile (found through the spatial index of the layer) are burned in it.
+        If an ``output_path`` is also given, the tiles are written directly into a tiled GeoTIFF and the full grid is
+        never held in memory.
+
         Parameters
         ----------
         attribute: str, optional
@@ -524,11 +873,18 @@ class VectorLayer(_Layer):
         output_path: str, optional
             A folder path where to save the output dataset. If not defined then the rasterized dataset is not
             saved.
+        tile_size: int, optional
+            Size in cells of the tiles used to rasterize the layer. It needs to be a multiple of 16, as it is also
+            used as block size of the output GeoTIFF. If not defined, the whole grid is rasterized at once.
+        workers: int, optional
+            Number of threads used to rasterize the tiles concurrently. Only used if ``tile_size`` is defined.
 
         Returns
         -------
         RasterLayer
-            :class:`RasterLayer` with the rasterized dataset of the current :class:`VectorLayer`.
+            :class:`RasterLayer` with the rasterized dataset of the current :class:`VectorLayer`. If the layer was
+            rasterized by tiles into an ``output_path``, the returned layer only points to the saved file and its
+            ``data`` is not loaded.
         """
         if isinstance(raster, RasterLayer):
             transform = raster.meta['transform']
@@ -547,13 +903,8 @@ class VectorLayer(_Layer):
         else:
             shapes = ((g, value) for g in self.data['geometry'].values)
             dtype = type(value)
+        dtype = np.dtype(dtype).name
 
-        rasterized = features.rasterize(
-            shapes,
-            out_shape=(height, width),
-            transform=transform,
-            all_touched=all_touched,
-            dtype=dtype)
         meta = dict(driver='GTiff',
                     dtype=dtype,
                     count=1,
@@ -563,18 +914,83 @@ class VectorLayer(_Layer):
                     transform=transform,
                     nodata=nodata)
         raster = RasterLayer(name=self.name)
-        raster.data = rasterized
         raster.meta = meta
 
-        if output_path:
-            raster.save(output_path)
+        if tile_size is None:
+            raster.data = features.rasterize(
+                shapes,
+                out_shape=(height, width),
+                transform=transform,
+                all_touched=all_touched,
+                dtype=dtype)
+            if output_path:
+                raster.save(output_path)
+        else:
+            values = self.data[attribute].values if attribute else None
+            self._rasterize_tiles(raster, values, value, tile_size, all_touched, output_path, workers)
 
         return raster
 
-    def start_points(self, raster: "RasterLayer") -> tuple[list[int], list[int]]:
+    def _rasterize_tiles(self, raster: 'RasterLayer', values: Optional[np.ndarray], value: Union[int, float],
+                         tile_size: int, all_touched: bool, output_path: Optional[str], workers: Optional[int]):
+        """Rasterizes the layer into the grid of ``raster`` tile by tile (see :meth:`rasterize`)."""
+        if tile_size % 16 != 0:
+            raise ValueError('The tile_size should be a multiple of 16.')
+        meta = raster.meta
+        height, width = meta['height'], meta['width']
+        geometries = self.data['geometry'].values
+        sindex = self.data.sindex
+        tiles = [windows.Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+                 for row in range(0, height, tile_size) for col in range(0, width, tile_size)]
+
+        def rasterize_tile(window):
+            idxs = sindex.query(shapely.box(*windows.bounds(window, meta['transform'])), predicate='intersects')
+            out_shape = (int(window.height), int(window.width))
+            if len(idxs) == 0:
+                return window, np.zeros(out_shape, dtype=meta['dtype'])
+            if values is None:
+                shapes = ((g, value) for g in geometries[idxs])
+            else:
+                shapes = zip(geometries[idxs], values[idxs])
+            return window, features.rasterize(shapes, out_shape=out_shape,
+                                              transform=windows.transform(window, meta['transform']),
+                                              all_touched=all_touched, dtype=meta['dtype'])
+
+        if output_path:
+            os.makedirs(output_path, exist_ok=True)
+            raster.path = os.path.join(output_path, raster.name + '.tif')
+            meta.update(compress='DEFLATE', tiled=True, blockxsize=tile_size, blockysize=tile_size)
+            dst = rasterio.open(raster.path, 'w', **meta)
+
+            def write(window, data):
+                dst.write(data, 1, window=window)
+        else:
+            dst = None
+            raster.data = np.zeros((height, width), dtype=meta['dtype'])
+
+            def write(window, data):
+                raster.data[window.toslices()] = data
+
+        # the tiles are rasterized by the workers and written from this thread only
+        try:
+            if (workers is None) or (workers <= 1):
+                for window in tiles:
+                    write(*rasterize_tile(window))
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for window, data in executor.map(rasterize_tile, tiles):
+                        write(window, data)
+        finally:
+            if dst is not None:
+                dst.close()
+
+    def start_points(self, raster: "RasterLayer") -> tuple[np.ndarray, np.ndarray]:
         """Gets the indexes of the overlapping cells of the :class:`VectorLayer` with the input :class:`RasterLayer`.
 
-        Uses the :doc:`rasterio.transform.rowcol<rasterio:api/rasterio.transform>` function to get the rows and columns.
+        The coordinates of all points are converted to rows and columns at once using the inverse of the raster
+        transform. Any other geometry type (lines, polygons or multi-part geometries) is rasterized onto the raster
+        grid with ``all_touched=True``, and every touched cell is returned. Points falling outside the raster grid are
+        dropped and cells overlapping more than one geometry are returned only once.
 
         Parameters
         ----------
@@ -583,24 +999,53 @@ class VectorLayer(_Layer):
 
         Returns
         -------
-        Tuple of lists rows and columns
-            Returns a tupe containing two list, the first one with the row indexes and the second one with the column
-            indexes.
+        Tuple of numpy ndarrays
+            Returns a tuple containing two integer arrays, the first one with the row indexes and the second one with
+            the column indexes.
         """
-        row_list = []
-        col_list = []
-        for index, row in self.data.iterrows():
-            rows, cols = rasterio.transform.rowcol(raster.meta['transform'], row["geometry"].x, row["geometry"].y)
-            row_list.append(rows)
-            col_list.append(cols)
-
-        return row_list, col_list
-
-    def save(self, output_path: str, name: str = None):
+        cells, _ = self._start_cells(raster)
+        width = raster.meta['width']
+        return cells // width, cells % width
+
+    def _start_cells(self, raster: "RasterLayer", feature_ids: bool = False) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        """Gets the sorted flat indexes of the cells overlapped by the layer (see :meth:`start_points`) and, if
+        ``feature_ids`` is `True`, the position in :attr:`data` of one of the features overlapping each cell."""
+        height, width = raster.meta['height'], raster.meta['width']
+        geometry = self.data.geometry.reset_index(drop=True)
+        geometry = geometry[geometry.notna() & ~geometry.is_empty]
+        is_point = (geometry.geom_type == 'Point').to_numpy()
+        cells = [np.array([], dtype=int)]
+        ids = [np.array([], dtype=int)]
+
+        if is_point.any():
+            points = geometry[is_point]
+            cols, rows = ~raster.meta['transform'] * (points.x.to_numpy(), points.y.to_numpy())
+            rows = np.floor(rows).astype(int)
+            cols = np.floor(cols).astype(int)
+            inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+            cells.append(rows[inside] * width + cols[inside])
+            ids.append(points.index.to_numpy()[inside])
+
+        if (~is_point).any():
+            others = geometry[~is_point]
+            # the position of the features is burned (shifted by one, as 0 is the background) only if needed
+            values = others.index.to_numpy() + 1 if feature_ids else np.ones(len(others), dtype=int)
+            touched = features.rasterize(zip(others.values, values),
+                                         out_shape=(height, width),
+                                         transform=raster.meta['transform'],
+                                         fill=0, all_touched=True, dtype='int32' if feature_ids else 'uint8')
+            touched_cells = np.flatnonzero(touched)
+            cells.append(touched_cells)
+            ids.append(touched.ravel()[touched_cells] - 1)
+
+        cells, first = np.unique(np.concatenate(cells), return_index=True)
+        return cells, np.concatenate(ids)[first] if feature_ids else None
+
+    def save(self, output_path: str, name: str = None, file_format: str = 'geojson'):
         """Saves the current :class:`VectorLayer` into disk.
 
-        It saves the layer in the ``output_path`` defined using the ``name`` attribute as filename and `geojson` as
-        extension.
+        It saves the layer in the ``output_path`` defined using the ``name`` attribute as filename and the
+        ``file_format`` as extension.
 
         Parameters
         ----------
@@ -608,31 +1053,26 @@ class VectorLayer(_Layer):
             Output folder where to save the layer.
         name: str, optional
             Name of the file, if not defined then the :attr:`name` attribute is used.
+        file_format: str, default 'geojson'
+            Either ``'geojson'`` or ``'parquet'``. GeoParquet files are written with a bounding box column, so they can
+            be read back filtering by a ``bbox`` without loading the whole file (see :meth:`read_layer`).
         """
+        if file_format not in ['geojson', 'parquet']:
+            raise ValueError("The file_format should be either 'geojson' or 'parquet'.")
         for column in self.data.columns:
             if isinstance(self.data[column].iloc[0], datetime.date):
                 self.data[column] = self.data[column].astype('datetime64')
         if not isinstance(name, str):
             name = self.name
         output_file = os.path.join(output_path,
-                                   name + '.geojson')
+                                   name + '.' + file_format)
         os.makedirs(output_path, exist_ok=True)
-        self.data.to_file(output_file, driver='GeoJSON')
+        if file_format == 'parquet':
+            self.data.to_parquet(output_file, write_covering_bbox=True)
+        else:
+            self.data.to_file(output_file, driver='GeoJSON')
         self.path = output_file
 
-    def _add_restricted_areas(self, layer_path, layer_type, **kwargs):
-        """Adds restricted areas for the calculations."""
-        if layer_type == 'vector':
-            i = len(self.restrictions) + 1
-            self.restrictions.append(VectorLayer(self.category,
-                                                 self.name + f' - restriction{i}',
-                                                 layer_path, **kwargs))
-        elif layer_type == 'raster':
-            i = len(self.restrictions) + 1
-            self.restrictions.append(RasterLayer(self.category,
-                                                 self.name + f' - restriction{i}',
-                                                 layer_path, **kwargs))
-
     @property
     def _type(self):
         vector_type = self.data['geometry'].iloc[0]
@@ -833,22 +1273,28 @@ class RasterLayer(_Layer):
     distance_raster
         :class:`RasterLayer` object containing a distance raster dataset calculated by the :meth:`get_distance_raster`
         method using one of the ``distance`` methods.
+    catchment
+        :class:`RasterLayer` with the nearest starting point of each cell, calculated by :meth:`travel_time` when the
+        ``catchment`` option is used.
     normalized
         :class:`RasterLayer` object containing a normalized raster dataset calculated by the :meth:`normalize`
         method using one of the ``normalization`` methods.
     restrictions
-        List of :class:`RasterLayer` or :class:`VectorLayer` used to restrict areas from the distance calculations.
-
-        .. warning::
-           The use of restrictions is under development and it will be available in future releases.
+        List of :class:`RasterLayer` or :class:`VectorLayer` used to restrict areas from the travel time calculations.
+        See :meth:`add_restricted_areas`.
 
     weight
         Value to weigh the layer's "importance" on the ``MCA`` model. It is initialized with a default value of 1.
+    travel_cache_size
+        Maximum number of travel time (and catchment) grids kept by :meth:`travel_time` to be reused by later calls
+        with the same starting cells. It defaults to 4.
     bounds
     data
-        :class:`numpy.ndarray<numpy:reference/arrays.ndarray> containing the data of the raster layer.
+    validity_mask
     """
 
+    travel_cache_size = 4
+
     def __init__(self, category: Optional[str] = None,
                  name: Optional[str] = '',
                  path: Optional[str] = None,
@@ -866,6 +1312,8 @@ class RasterLayer(_Layer):
         self.meta = {}
         self.normalized = None
         self.starting_points = None
+        self._travel_lock = threading.Lock()
+        self._travel_results = OrderedDict()
         super().__init__(category=category, name=name,
                          path=path, conn=conn,
                          normalization=normalization, inverse=inverse,
@@ -878,7 +1326,85 @@ class RasterLayer(_Layer):
 
     def __str__(self):
         return 'Raster' + super().__str__()
-        
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_validity_mask'] = None
+        state['_stats_cache'] = {}
+        state['_travel_cache'] = {}
+        state['_travel_results'] = OrderedDict()
+        state['_restriction_cache'] = {}
+        state.pop('_travel_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        # layers pickled before ``data`` became a property store the array under ``data``
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        state.setdefault('_validity_mask', None)
+        state.setdefault('_validity_nodata', None)
+        state.setdefault('_stats_cache', {})
+        state.setdefault('_travel_cache', {})
+        state.setdefault('_travel_results', OrderedDict())
+        state.setdefault('_restriction_cache', {})
+        state['_travel_lock'] = threading.Lock()
+        self.__dict__.update(state)
+
+    @property
+    def data(self) -> np.ndarray:
+        """:class:`numpy.ndarray<numpy:reference/arrays.ndarray>` containing the data of the raster layer.
+
+        Setting a new array resets the cached :attr:`validity_mask`, statistics, travel time graph and restriction
+        masks. If the array is modified in place (e.g. ``layer.data[layer.data > 60] = 0``), reassign it with
+        ``layer.data = layer.data`` to reset the cache.
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data: np.ndarray):
+        self._data = data
+        self._validity_mask = None
+        self._validity_nodata = None
+        self._stats_cache = {}
+        self._travel_cache = {}
+        self._travel_results = OrderedDict()
+        self._restriction_cache = {}
+
+    @property
+    def validity_mask(self) -> np.ndarray:
+        """Boolean array flagging the cells of :attr:`data` that hold valid values.
+
+        A cell is valid if it is not equal to ``meta['nodata']`` and, for float data, it is not ``np.nan``. The mask is
+        computed lazily and cached until the :attr:`data` array or the ``nodata`` value of the metadata change.
+        """
+        nodata = self.meta.get('nodata')
+        if (self._validity_mask is None) or (self._validity_nodata is not nodata
+                                             and self._validity_nodata != nodata):
+            if nodata is None:
+                mask = np.ones(self.data.shape, dtype=bool)
+            else:
+                mask = self.data != nodata
+            if np.issubdtype(self.data.dtype, np.floating):
+                mask &= ~np.isnan(self.data)
+            self._validity_mask = mask
+            self._validity_nodata = nodata
+            self._stats_cache = {}
+            self._travel_cache = {}
+            self._travel_results = OrderedDict()
+            self._restriction_cache = {}
+        return self._validity_mask
+
+    def _order_statistics(self, indexes: list[int]) -> np.ndarray:
+        """Gets the values that would be at the ``indexes`` positions of the sorted valid data.
+
+        It uses :doc:`numpy:reference/generated/numpy.partition` to place only the requested elements in their sorted
+        position instead of sorting the whole array.
+        """
+        x = self.data[self.validity_mask]
+        indexes = np.clip(indexes, 0, x.shape[0] - 1)
+        x.partition(np.unique(indexes))
+        return x[indexes]
+
     @property
     def bounds(self) -> list[float]:
         """Wrapper property to get the  west, south, east, north bounds of the dataset using the
@@ -1004,6 +1530,7 @@ class RasterLayer(_Layer):
                                                nodata=0, all_touched=all_touched)
 
         self.data[rasterized_mask.data == 0] = self.meta['nodata']
+        self.data = self.data  # resets the cached validity mask after the in place edit
 
         if crop:
             total_bounds = mask_layer.data['geometry'].total_bounds
@@ -1092,10 +1619,223 @@ class RasterLayer(_Layer):
                                                    dst_height=self.meta['height'])
         return t, w, h
 
+    def _restriction_mask(self, raster: 'RasterLayer') -> np.ndarray:
+        """Gets a boolean array flagging the valid non-zero cells of the layer in the grid of ``raster``.
+
+        The layer is aligned to the grid if needed. The result is cached per grid, and the cache is reset when the
+        :attr:`data` of the layer changes.
+        """
+        key = self._grid_key(raster)
+        # resets the cache first if the ``nodata`` value changed
+        validity_mask = self.validity_mask
+        if key not in self._restriction_cache:
+            if self._grid_key(self) == key:
+                mask = validity_mask & (self.data != 0)
+            else:
+                layer = self.align(raster, inplace=False)
+                mask = layer.validity_mask & (layer.data != 0)
+            self._restriction_cache[key] = mask
+        return self._restriction_cache[key]
+
+    def _restricted_cells(self, restrictions: Optional[list[Union['VectorLayer', 'RasterLayer']]] = None
+                          ) -> Optional[np.ndarray]:
+        """Combines the masks of the ``restrictions`` (or of the :attr:`restrictions` attribute) in the grid of the
+        layer. Returns None if there are no restrictions."""
+        if restrictions is None:
+            restrictions = self.restrictions
+        if not restrictions:
+            return None
+        restricted = np.zeros(self.data.shape, dtype=bool)
+        for restriction in restrictions:
+            restricted |= restriction._restriction_mask(self)
+        return restricted
+
+    @staticmethod
+    def _restriction_key(restricted: Optional[np.ndarray]) -> Optional[str]:
+        """Identifies a set of restricted cells."""
+        if restricted is None:
+            return None
+        return hashlib.sha1(np.packbits(restricted).tobytes()).hexdigest()
+
+    def _cost_surface(self, restricted: Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns the cost surface (in hours per kilometer) used by :meth:`travel_time`, building it only the first
+        time it is needed. If ``restricted`` cells are given, a copy of the surface where they are impassable is
+        returned instead, which is not kept."""
+        mask = self.validity_mask
+        if 'cost' not in self._travel_cache:
+            layer = self.data * (1000 / 60)  # to convert to hours per kilometer
+            layer[~mask | (layer < 0)] = float('inf')
+            self._travel_cache['cost'] = layer
+        if restricted is None:
+            return self._travel_cache['cost']
+        layer = self._travel_cache['cost'].copy()
+        layer[restricted] = float('inf')
+        return layer
+
+    def _travel_graph(self, restricted: Optional[np.ndarray] = None) -> tuple[np.ndarray, 'MCP_Geometric']:
+        """Returns the cost surface and the graph used by :meth:`travel_time`, building them only the first time they
+        are needed. The graph of a surface with ``restricted`` cells is built for each solve and not kept."""
+        if restricted is not None:
+            layer = self._cost_surface(restricted)
+            return layer, MCP_Geometric(layer, fully_connected=True)
+        layer = self._cost_surface()
+        if 'graph' not in self._travel_cache:
+            self._travel_cache['graph'] = (layer, MCP_Geometric(layer, fully_connected=True))
+        return self._travel_cache['graph']
+
+    @staticmethod
+    def _cost_graph(layer: np.ndarray, sources: Optional[np.ndarray] = None) -> 'csr_matrix':
+        """Builds a sparse graph of the 8 neighbours of each cell of a cost surface.
+
+        The edges have the same costs as in :class:`MCP_Geometric`, the mean cost of both cells times the length of the
+        step, so :func:`scipy.sparse.csgraph.dijkstra` gives the same cumulative costs. Impassable cells have no edges.
+        If an array of ``sources`` costs is given, an extra last node is linked to every cell with a finite source cost
+        through an edge of that cost, so a search from that node starts from all cells with their current cost.
+        """
+        height, width = layer.shape
+        size = height * width
+        idx = np.arange(size).reshape(height, width)
+        rows, cols, weights = [], [], []
+        for dr, dc, length in [(0, 1, 1), (1, 0, 1), (1, 1, np.sqrt(2)), (1, -1, np.sqrt(2))]:
+            a = (slice(0, height - dr), slice(max(0, -dc), width - max(0, dc)))
+            b = (slice(dr, height), slice(max(0, dc), width + min(0, dc)))
+            weight = (layer[a] + layer[b]) / 2 * length
+            valid = np.isfinite(weight)
+            rows.append(idx[a][valid])
+            cols.append(idx[b][valid])
+            weights.append(weight[valid])
+        if sources is not None:
+            valid = np.isfinite(sources.ravel())
+            rows.append(np.full(valid.sum(), size))
+            cols.append(idx.ravel()[valid])
+            weights.append(sources.ravel()[valid])
+            size += 1
+        # edges with zero weight would be dropped by the sparse graph
+        weights = np.maximum(np.concatenate(weights), np.finfo(float).tiny)
+        return csr_matrix((weights, (np.concatenate(rows), np.concatenate(cols))), shape=(size, size))
+
+    def _travel_csgraph(self, restricted: Optional[np.ndarray] = None) -> tuple[np.ndarray, 'csr_matrix']:
+        """Returns the cost surface and its sparse graph (see :meth:`_cost_graph`), building them only the first time
+        they are needed. The graph of a surface with ``restricted`` cells is built for each solve and not kept."""
+        if restricted is not None:
+            layer = self._cost_surface(restricted)
+            return layer, self._cost_graph(layer)
+        layer = self._cost_surface()
+        if 'csgraph' not in self._travel_cache:
+            self._travel_cache['csgraph'] = self._cost_graph(layer)
+        return layer, self._travel_cache['csgraph']
+
+    def _fits_in_memory(self) -> bool:
+        """Checks whether the graph of the whole cost surface fits in the available memory, taking about 48 bytes per
+        cell. If the available memory can not be known, it is assumed to fit."""
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            return True
+        return self.data.size * 48 < available
+
+    def _tiled_travel_time(self, seeds: np.ndarray, tile_size: int, max_cost: Optional[float] = None,
+                           workers: Optional[int] = None, layer: Optional[np.ndarray] = None) -> np.ndarray:
+        """Calculates the cumulative costs from the ``seeds`` (flat indexes) solving the cost surface by tiles.
+
+        Every tile is solved together with a ring of one cell around it, starting from the cells of its window whose
+        cost improved since it was last solved. The improved costs are exchanged through the overlapping cells, so the
+        tiles around them are queued again until no cost improves. As in a Dijkstra search, the queued tiles with the
+        lowest starting cost are solved first, ``workers`` at a time in parallel processes (the solver holds the GIL).
+        The process pool is started by a fork server, as the method can be called from threads, and shut down at the
+        end of the call. The cost surface given as ``layer`` is used instead of :meth:`_cost_surface` if defined.
+
+        Cells on the tile borders are usually solved several times, so on a single core this is 2 to 3 times slower
+        than solving the whole surface at once. It only pays off with several ``workers``, or when the graph of the
+        whole surface does not fit in memory.
+        """
+        if layer is None:
+            layer = self._cost_surface()
+        height, width = layer.shape
+        tile_cols = -(-width // tile_size)
+        limit = np.inf if max_cost is None else max_cost
+        costs = np.full(layer.shape, np.inf)
+        costs.flat[seeds] = 0
+        improved_cells = np.zeros(layer.shape, dtype=bool)
+
+        def window(tile):
+            row, col = tile[0] * tile_size, tile[1] * tile_size
+            return (slice(max(row - 1, 0), min(row + tile_size + 1, height)),
+                    slice(max(col - 1, 0), min(col + tile_size + 1, width)))
+
+        def tiles_around(rows, cols):
+            # tiles whose window (tile plus ring) contains any of the cells
+            tiles = [(np.clip(rows + dr, 0, height - 1) // tile_size) * tile_cols +
+                     np.clip(cols + dc, 0, width - 1) // tile_size
+                     for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+            return [divmod(int(tile), tile_cols) for tile in np.unique(np.concatenate(tiles))]
+
+        # starting costs of the queued tiles, with `inf` for the cells that did not improve, and a heap of the lowest
+        # starting cost of each tile (older entries of a tile are skipped when popped)
+        queue = {}
+        lowest = {}
+        heap = []
+
+        def enqueue(rows, cols, solved=None):
+            improved_cells[rows, cols] = True
+            for tile in tiles_around(rows, cols):
+                if tile == solved:
+                    continue
+                w = window(tile)
+                mask = improved_cells[w]
+                sources = queue.setdefault(tile, np.full(mask.shape, np.inf))
+                sources[mask] = costs[w][mask]
+                cost = sources[mask].min()
+                if cost < lowest.get(tile, np.inf):
+                    lowest[tile] = cost
+                    heapq.heappush(heap, (cost, tile))
+            improved_cells[rows, cols] = False
+
+        enqueue(*np.divmod(seeds, width))
+        if (workers is not None) and (workers > 1):
+            # forking a process that runs other threads can deadlock the children
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        else:
+            pool = nullcontext()
+        with pool as executor:
+            while heap:
+                batch = []
+                while heap and (len(batch) < (workers if executor else 1)):
+                    cost, tile = heapq.heappop(heap)
+                    if (tile in queue) and (lowest[tile] == cost):
+                        batch.append(tile)
+                if not batch:
+                    continue
+                sources = [queue.pop(tile) for tile in batch]
+                for tile in batch:
+                    del lowest[tile]
+                layers = [layer[window(tile)] for tile in batch]
+                if executor is None:
+                    results = list(map(_solve_cost_tile, layers, sources, [limit] * len(batch)))
+                else:
+                    results = list(executor.map(_solve_cost_tile, layers, sources, [limit] * len(batch)))
+                for tile, local in zip(batch, results):
+                    w = window(tile)
+                    region = costs[w]
+                    improved = local * (1 + 1e-12) < region
+                    if improved.any():
+                        region[improved] = local[improved]
+                        rows, cols = np.nonzero(improved)
+                        enqueue(rows + w[0].start, cols + w[1].start, solved=tile)
+        return costs
+
     def travel_time(self, rows: np.ndarray, cols: np.ndarray,
                     include_starting_cells: bool = False,
                     output_path: Optional[str] = None,
-                    create_raster: Optional[bool] = True) -> 'RasterLayer':
+                    create_raster: Optional[bool] = True,
+                    max_cost: Optional[float] = None,
+                    catchment: bool = False,
+                    tile_size: Optional[int] = None,
+                    workers: Optional[int] = None,
+                    restrictions: Optional[list[Union['VectorLayer', 'RasterLayer']]] = None
+                    ) -> Union['RasterLayer', tuple['RasterLayer', 'RasterLayer']]:
         """Calculates a travel time map using the raster data as cost surface and specific cells as starting points.
 
         This method uses the data of the current :class:`RasterLayer` as a cost surface, to calculate the
@@ -1116,27 +1856,109 @@ class RasterLayer(_Layer):
         create_raster: bool, default True
             Boolean condition. If `True`, a :class:`RasterLayer` will be created and stored in the ``distance_raster``
             attribute of the class. If `False`, a :class:`RasterLayer` with the travel time calculation is returned.
+        max_cost: float, optional
+            Maximum travel time (in hours) to search for. The search stops expanding once this cost is exceeded and the
+            valid cells not reached (including those with no path to the starting points) get ``max_cost`` as travel
+            time. This is much faster when the starting points are sparse.
+            If not defined, the travel time to every cell is calculated.
+        catchment: bool, default False
+            Whether to also get the catchment of every starting cell, i.e. an int32 raster with the position (in
+            ``rows`` and ``cols``) of the starting cell each cell is reached from, or -1 where no starting cell is
+            reached. It is obtained from the same solve. If ``create_raster`` is `True` it is stored in the
+            ``catchment`` attribute, otherwise it is returned along with the travel time.
+        tile_size: int, optional
+            If defined, the cost surface is solved by square tiles of this size (in cells) instead of at once. The
+            tiles overlap by one cell and are solved again while their neighbours improve the costs of the shared
+            cells, giving the same result as the full solve. This uses less memory and several cores for large
+            surfaces, but on a single core it is 2 to 3 times slower than the full solve, as the tile borders are
+            solved several times. Thus, the tiles are only used if ``workers`` is larger than 1 or the graph of the
+            whole surface would not fit in the available memory, and a warning is issued otherwise. It can not be
+            combined with ``catchment``.
+        workers: int, optional
+            Number of processes used to solve the tiles concurrently. Only used if ``tile_size`` is defined.
+        restrictions: list of VectorLayer or RasterLayer, optional
+            Restricted areas (see :meth:`add_restricted_areas`) that are impassable in the cost surface, and get
+            `np.nan` as travel time. If not defined, the :attr:`restrictions` of the layer are used. The raster data
+            is not modified.
 
         Returns
         -------
-        RasterLayer
-            :class:`RasterLayer` with the least-cost travel time data.
+        RasterLayer or tuple of RasterLayer
+            :class:`RasterLayer` with the least-cost travel time data, and the catchment :class:`RasterLayer` if
+            ``catchment`` is `True`.
+
+        Notes
+        -----
+        The cost surface and the graph built from the raster data are kept between calls, as well as the travel times
+        of the last :attr:`travel_cache_size` solves, so several technologies using the same friction layer and
+        starting points share a single solve. The cache is cleared when the :attr:`data` is reassigned. Surfaces and
+        graphs with restricted cells are built for each solve and released afterwards.
         """
-        layer = self.data.copy()
-        layer *= (1000 / 60)  # to convert to hours per kilometer
-        layer[np.isnan(layer)] = float('inf')
-        layer[layer == self.meta['nodata']] = float('inf')
-        layer[layer < 0] = float('inf')
-        mcp = MCP_Geometric(layer, fully_connected=True)
-        pointlist = np.column_stack((rows, cols))
-        # TODO: create method for restricted areas
-        if len(pointlist) > 0:
-            cumulative_costs, traceback = mcp.find_costs(starts=pointlist)
-            if include_starting_cells:
-                cumulative_costs += layer
-            cumulative_costs[np.where(cumulative_costs == float('inf'))] = np.nan
-        else:
-            cumulative_costs = np.full(self.data.shape, 7.0)
+        if catchment and (tile_size is not None):
+            raise ValueError('The catchment can not be calculated with the tiled travel time, do not set `tile_size`.')
+        if (tile_size is not None) and ((workers is None) or (workers <= 1)) and self._fits_in_memory():
+            # without parallel workers the tiles are only worth it if the whole surface can not be solved at once
+            warn(f'The tile_size of {tile_size} is ignored, as without several workers the travel time is faster '
+                 f'solved at once and the surface fits in memory.', stacklevel=2)
+            tile_size = None
+        pointlist = np.column_stack((rows, cols)).astype(np.int64)
+        seeds_hash = hashlib.sha1(pointlist.tobytes()).hexdigest()
+        # the graph can not be used from several threads at the same time
+        with self._travel_lock:
+            restricted = self._restricted_cells(restrictions)
+            restriction_key = self._restriction_key(restricted)
+            key = ('travel_time', seeds_hash, include_starting_cells, max_cost, tile_size, restriction_key)
+            catchment_key = ('catchment', seeds_hash, max_cost, restriction_key)
+            results = self._travel_results
+            if (key not in results) or (catchment and catchment_key not in results):
+                labels = np.full(self.data.shape, -1, dtype=np.int32)
+                if len(pointlist) > 0:
+                    seeds = np.ravel_multi_index(pointlist.T, self.data.shape)
+                    if tile_size is not None:
+                        layer = self._cost_surface(restricted)
+                        cumulative_costs = self._tiled_travel_time(seeds, tile_size, max_cost=max_cost,
+                                                                   workers=workers, layer=layer)
+                        if max_cost is not None:
+                            cumulative_costs[np.isinf(cumulative_costs) & np.isfinite(layer)] = max_cost
+                    elif max_cost is None:
+                        layer, mcp = self._travel_graph(restricted)
+                        cumulative_costs, traceback = mcp.find_costs(starts=pointlist)
+                        if catchment:
+                            labels = self._seed_labels(self._traceback_parents(traceback, np.asarray(mcp.offsets)),
+                                                       seeds).reshape(layer.shape)
+                    else:
+                        # MCP_Geometric can not stop the search at a given cost, so a bounded dijkstra is used
+                        layer, graph = self._travel_csgraph(restricted)
+                        cumulative_costs, _, sources = dijkstra(graph, directed=False,
+                                                                min_only=True, indices=seeds, limit=max_cost,
+                                                                return_predecessors=True)
+                        cumulative_costs = cumulative_costs.reshape(layer.shape)
+                        cumulative_costs[np.isinf(cumulative_costs) & np.isfinite(layer)] = max_cost
+                        if catchment:
+                            # the sources are the seed cells themselves, so each one is its own root
+                            labels = self._seed_labels(np.where(sources >= 0, sources, np.arange(sources.size)),
+                                                       seeds).reshape(layer.shape)
+                    if include_starting_cells:
+                        cumulative_costs += layer
+                    cumulative_costs[np.where(cumulative_costs == float('inf'))] = np.nan
+                    if restricted is not None:
+                        # starting cells inside restricted areas are not reached either
+                        cumulative_costs[restricted] = np.nan
+                        labels[restricted] = -1
+                else:
+                    cumulative_costs = np.full(self.data.shape, 7.0)
+                self._cache_travel_result(key, cumulative_costs)
+                if catchment:
+                    self._cache_travel_result(catchment_key, labels)
+            else:
+                cumulative_costs = results[key]
+                results.move_to_end(key)
+                if catchment:
+                    labels = results[catchment_key]
+                    results.move_to_end(catchment_key)
+            cumulative_costs = cumulative_costs.copy()
+            if catchment:
+                labels = labels.copy()
 
         distance_raster = RasterLayer(self.category,
                                       'traveltime',
@@ -1149,14 +1971,61 @@ class RasterLayer(_Layer):
         distance_raster.data = cumulative_costs  # + (self.friction.layer * 1000 / 60)
         distance_raster.meta = meta
 
+        if catchment:
+            catchment_raster = RasterLayer(self.category, 'catchment')
+            catchment_raster.data = labels
+            catchment_raster.meta = dict(self.meta, nodata=-1, dtype='int32')
+
         if output_path:
             distance_raster.save(output_path)
+            if catchment:
+                catchment_raster.save(output_path)
 
         if create_raster:
             self.distance_raster = distance_raster
+            if catchment:
+                self.catchment = catchment_raster
+        elif catchment:
+            return distance_raster, catchment_raster
         else:
             return distance_raster
 
+    def _cache_travel_result(self, key: tuple, result: np.ndarray):
+        """Keeps a result of :meth:`travel_time`, dropping the least recently used results so that at most
+        :attr:`travel_cache_size` grids are kept."""
+        self._travel_results[key] = result
+        self._travel_results.move_to_end(key)
+        while len(self._travel_results) > self.travel_cache_size:
+            self._travel_results.popitem(last=False)
+
+    @staticmethod
+    def _traceback_parents(traceback: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """Converts the traceback of :meth:`MCP_Geometric.find_costs` into the flat index of the predecessor of every
+        cell. Starting and not reached cells are their own predecessor."""
+        parents = np.arange(traceback.size)
+        visited = traceback.ravel() >= 0
+        steps = offsets[traceback.ravel()[visited]]
+        rows, cols = np.divmod(parents[visited], traceback.shape[1])
+        parents[visited] = (rows - steps[:, 0]) * traceback.shape[1] + (cols - steps[:, 1])
+        return parents
+
+    @staticmethod
+    def _seed_labels(parents: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+        """Labels every cell with the position in ``seeds`` of the starting cell it is reached from, or -1.
+
+        The roots of the shortest path trees are found by pointer jumping, so every iteration halves the remaining
+        depth of the paths.
+        """
+        while True:
+            grandparents = parents[parents]
+            if np.array_equal(grandparents, parents):
+                break
+            parents = grandparents
+        # if a cell is given twice as starting point, its first position is used
+        seed_labels = np.full(parents.size, -1, dtype=np.int32)
+        seed_labels[seeds[::-1]] = np.arange(len(seeds) - 1, -1, -1, dtype=np.int32)
+        return seed_labels[parents]
+
     def log(self, mask_layer: VectorLayer,
             output_path: Optional[str] = None,
             create_raster: Optional[bool] = True) -> 'RasterLayer':
@@ -1325,13 +2194,13 @@ class RasterLayer(_Layer):
             :class:`RasterLayer` with the normalized data.
         """
         if self.normalization == 'MinMax':
-            raster = self.data.astype(float).copy()
+            raster = self.data.astype(float)
             nodata = float(self.meta['nodata'])
             meta = self.meta.copy()
             if callable(self.distance_limit):
                 raster[~self.distance_limit(raster)] = np.nan
 
-            raster[raster == nodata] = np.nan
+            raster[~self.validity_mask] = np.nan
             min_value = np.nanmin(raster)
             max_value = np.nanmax(raster)
             raster = (raster - min_value) / (max_value - min_value)
@@ -1454,6 +2323,87 @@ class RasterLayer(_Layer):
             raster.meta = meta
             return raster
 
+    def warp_to(self, base_layer: 'RasterLayer', path: Optional[str] = None, mask: Optional[np.ndarray] = None,
+                rescale: Optional[bool] = None, output_path: Optional[str] = None):
+        """Reads the raster from its source file directly onto the grid of a base layer.
+
+        It fuses the :meth:`read_layer`, :meth:`reproject`, :meth:`align` and :meth:`mask` steps into a single
+        warp from the source file to the grid of the ``base_layer``, so the data is resampled only once and only the
+        part of the source file covering the base grid is read.
+
+        Parameters
+        ----------
+        base_layer: RasterLayer
+            Raster layer to use as base for the grid alignment.
+        path: str, optional
+            Path to the source file. If not defined, the ``path`` attribute is used.
+        mask: np.ndarray, optional
+            Boolean array in the grid of the ``base_layer`` flagging the cells to keep. The other cells are set to the
+            ``nodata`` value.
+        rescale: bool, optional
+            Whether to rescale the values proportionally to the cell size difference between the ``base_layer`` and
+            the source file. If not defined then the ``rescale`` attribute is used.
+        output_path: str, optional
+            A folder path where to save the output dataset. If not defined then the warped raster is not saved to
+            disk.
+        """
+        if path is None:
+            path = self.path
+        if rescale is None:
+            rescale = self.rescale
+        base_meta = base_layer.meta
+        with rasterio.open(path) as src:
+            meta = src.meta.copy()
+            if meta['nodata'] is None:
+                if np.issubdtype(np.dtype(meta['dtype']), np.floating):
+                    meta['nodata'] = np.nan
+                else:
+                    meta['nodata'] = 0
+                warn(f"The {self.name} layer do not have a defined nodata value, thus {meta['nodata']} was assigned. "
+                     f"You can change this defining the nodata value in the metadata of the variable as: "
+                     f"variable.meta['nodata'] = value")
+            data = np.full((base_meta['height'], base_meta['width']), meta['nodata'], dtype=meta['dtype'])
+            warp.reproject(source=rasterio.band(src, 1), destination=data,
+                           src_nodata=meta['nodata'], dst_nodata=meta['nodata'],
+                           dst_transform=base_meta['transform'], dst_crs=base_meta['crs'],
+                           resampling=Resampling[self.resample])
+            if rescale:
+                # cell size of the source, in the crs of the base layer, over the area covered by the base grid
+                bounds = warp.transform_bounds(base_meta['crs'], src.crs, *base_layer.bounds)
+                window = windows.from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+                window = window.intersection(windows.Window(0, 0, src.width, src.height))
+                t = warp.calculate_default_transform(src.crs, base_meta['crs'], window.width, window.height,
+                                                     *windows.bounds(window, src.transform),
+                                                     dst_width=window.width, dst_height=window.height)[0]
+
+        meta.update(driver='GTiff', transform=base_meta['transform'], crs=base_meta['crs'],
+                    width=base_meta['width'], height=base_meta['height'], compress='DEFLATE')
+        if rescale:
+            data = data.astype(float)
+            data[~self._valid_cells(data, meta['nodata'])] = np.nan
+            data *= (base_meta['transform'][0] ** 2) / (t[0] ** 2)
+            meta.update(nodata=np.nan, dtype=data.dtype.name)
+        if mask is not None:
+            data[~mask] = meta['nodata']
+        if np.issubdtype(data.dtype, np.integer):
+            meta['nodata'] = int(meta['nodata'])
+        else:
+            meta['nodata'] = float(meta['nodata'])
+
+        self.data = data
+        self.meta = meta
+        self.path = path
+        if output_path:
+            self.save(output_path)
+
+    @staticmethod
+    def _valid_cells(data: np.ndarray, nodata: Union[int, float, None]) -> np.ndarray:
+        """Flags the cells of ``data`` that are not ``nodata`` (or `np.nan` for float data)."""
+        valid = np.ones(data.shape, dtype=bool) if nodata is None else data != nodata
+        if np.issubdtype(data.dtype, np.floating):
+            valid &= ~np.isnan(data)
+        return valid
+
     def cumulative_count(self, min_max: list[float, float] = [0.02, 0.98]) -> np.ndarray:
         """Calculates a new data array flattening the raster's data values that fall in either of the specified lower
         or upper percentile.
@@ -1461,7 +2411,8 @@ class RasterLayer(_Layer):
         For example, if we use a ``min_max`` of ``[0.02, 0.98]``, the array will be first ordered in ascending
         order and then all values that fall inside the lowest 2% will be "flattened" giving them the value of the
         highest number inside that 2%. The same is done for the upper bound, where all data values that fall in the
-        highest 2% will be given the value of the lowest number within that 2%.
+        highest 2% will be given the value of the lowest number within that 2%. The two limit values are found with a
+        partial sort of the data and cached in the layer until the :attr:`data` or its ``nodata`` value change.
 
         Parameters
         ----------
@@ -1473,24 +2424,19 @@ class RasterLayer(_Layer):
         np.ndarray
            Raster data array with the flattened values.
         """
-        x = self.data.astype('float64').copy()
-        x[x == self.meta['nodata']] = np.nan
-        x = x.flat
-        x = np.sort(x[~np.isnan(x)])
-        count = x.shape[0]
-        max_val = x[int(count * min_max[1])]
-        min_val = x[int(count * min_max[0])]
-        layer = self.data.copy()
-        layer[layer == self.meta['nodata']] = np.nan
-        layer[layer > max_val] = max_val
-        layer[layer < min_val] = min_val
-        return layer
+        mask = self.validity_mask
+        key = ('cumulative_count', tuple(min_max))
+        if key not in self._stats_cache:
+            count = int(mask.sum())
+            self._stats_cache[key] = self._order_statistics([int(count * min_max[0]), int(count * min_max[1])])
+        min_val, max_val = self._stats_cache[key]
+        return np.where(mask, np.clip(self.data, min_val, max_val), np.nan)
 
     def get_quantiles(self, quantiles: tuple[float]) -> np.ndarray:
         """Gets the values of th specified quantiles.
 
         It uses the :doc:`numpy:reference/generated/numpy.quantile` function to return the quantiles of
-        the raster array.
+        the raster array. The values are cached in the layer until the :attr:`data` or its ``nodata`` value change.
 
         Parameters
         ----------
@@ -1508,16 +2454,60 @@ class RasterLayer(_Layer):
         """
         if isinstance(quantiles, float) or isinstance(quantiles, int):
             quantiles = [quantiles]
-        x = self.data.astype('float64').copy()
-        x[x == self.meta['nodata']] = np.nan
-        x = x.flat
-        x = x[~np.isnan(x)].copy()
-        return np.quantile(x, quantiles)
+        mask = self.validity_mask
+        key = ('quantiles', tuple(quantiles))
+        if key not in self._stats_cache:
+            self._stats_cache[key] = np.quantile(self.data[mask], quantiles)
+        return self._stats_cache[key].copy()
+
+    def quantile_classes(self, quantiles: tuple[float], chunk_size: int = 1024) -> np.ndarray:
+        """Classifies every cell of the raster array into the quantile interval it falls in.
+
+        The class of a cell is the index of the first quantile value that is higher than the cell value, with the
+        highest quantile value included in the last class. Cells that are not valid or that fall above the highest
+        quantile are given the class 255. The classification is done in chunks of rows, writing directly into a
+        ``uint8`` array.
+
+        Parameters
+        ----------
+        quantiles: array-like of float
+            Quantile or sequence of quantiles to compute, which must be between 0 and 1 inclusive. At most 255
+            quantiles can be used.
+        chunk_size: int, default 1024
+            Number of rows classified at a time.
+
+        Returns
+        -------
+        np.ndarray
+            ``uint8`` array with the class of every cell.
+
+        See also
+        --------
+        get_quantiles
+        quantiles
+        """
+        if isinstance(quantiles, float) or isinstance(quantiles, int):
+            quantiles = [quantiles]
+        if len(quantiles) > 255:
+            raise ValueError('At most 255 quantiles can be used for the classification.')
+        qs = self.get_quantiles(quantiles)
+        n = len(qs)
+        mask = self.validity_mask
+        classes = np.empty(self.data.shape, dtype=np.uint8)
+        for start in range(0, self.data.shape[0], chunk_size):
+            data = self.data[start:start + chunk_size]
+            chunk = np.searchsorted(qs, data, side='right')
+            chunk[(chunk == n) & (data <= qs[-1])] = n - 1
+            chunk[(chunk == n) | ~mask[start:start + chunk_size]] = 255
+            classes[start:start + chunk_size] = chunk
+        return classes
 
     def quantiles(self, quantiles: tuple[float]) -> np.ndarray:
         """Computes an array based on the desired quantiles of the raster array.
 
-        It creates an array with the quantile categories of the raster array. Uses the :meth:`get_quantiles` method.
+        It creates an array with the quantile categories of the raster array, where every cell takes the value of its
+        quantile multiplied by 100. The cells are classified with the :meth:`quantile_classes` method and the labels
+        are then looked up from the class array.
 
         Parameters
         ----------
@@ -1532,27 +2522,13 @@ class RasterLayer(_Layer):
         See also
         --------
         get_quantiles
+        quantile_classes
         """
         if isinstance(quantiles, float) or isinstance(quantiles, int):
             quantiles = [quantiles]
-        qs = self.get_quantiles(quantiles)
-        layer = self.data.copy()
-        layer[layer == self.meta['nodata']] = np.nan
-        i = 0
-        min_val = np.nanmin(layer)
-        layer = layer - min_val
-        qs = qs - min_val
-        new_layer = layer.copy()
-        while i < len(qs):
-            if i == 0:
-                new_layer[(layer >= 0) & (layer < qs[i])] = quantiles[i] * 100
-            else:
-                new_layer[(layer >= qs[i - 1]) & (layer < qs[i])] = quantiles[i] * 100
-            i += 1
-        if len(qs) > 1:
-            new_layer[(layer >= qs[-2]) & (layer <= qs[-1])] = quantiles[-1] * 100
-        new_layer[layer > qs[-1]] = np.nan
-        return new_layer
+        labels = np.full(256, np.nan)
+        labels[:len(quantiles)] = np.array(quantiles) * 100
+        return labels[self.quantile_classes(quantiles)]
 
     @staticmethod
     def category_legend(im: matplotlib.image.AxesImage, ax: matplotlib.axes.Axes, categories: dict,
@@ -1794,9 +2770,7 @@ class RasterLayer(_Layer):
             if legend_title is None:
                 legend_title = 'Quantiles'
         else:
-            layer = self.data
-            layer = layer.astype('float64')
-            layer[layer == self.meta['nodata']] = np.nan
+            layer = np.where(self.validity_mask, self.data, np.nan)
 
 
         if ax is None:
@@ -7,13 +7,14 @@ from warnings import warn
 import dill
 import matplotlib
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from pyproj import CRS
 import pandas as pd
 import numpy as np
 import geopandas as gpd
 import rasterio
 import matplotlib.pyplot as plt
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 import scipy.spatial
 from copy import copy
 from csv import DictReader
@@ -24,7 +25,7 @@ from matplotlib.offsetbox import (TextArea, AnnotationBbox, VPacker, HPacker)
 from rasterio import features
 from rasterio.fill import fillnodata
 from rasterio.warp import transform_bounds
-from scipy.interpolate import griddata
+from scipy import ndimage
 from plotnine import (
     ggplot,
     element_text,
@@ -56,6 +57,7 @@ from onstove.technology import Technology, LPG, Biomass, Electricity, Biogas, Ch
 from onstove.raster import sample_raster
 from onstove._utils import Processes, deep_update
 from onstove._layer_utils import raster_setter
+from onstove._cache import RasterCache
 
 
 def timeit(func):
@@ -97,11 +99,16 @@ class DataProcessor:
     mask_layer: VectorLayer
         Layer used to mask all datasets when calling the :meth:`mask_layers` method. It is set with the
         :meth:`add_mask_layer` method.
-    conn: psycopg2.connect
-        Connection to a PostgreSQL database, set with the :meth:`set_postgres` method.
+    conn: psycopg2.pool.ThreadedConnectionPool
+        Pool of connections to a PostgreSQL database, set with the :meth:`set_postgres` method.
     base_layer:
         RasterLayer to use as template for all raster based data processes. For example, the :meth:`align_layers` uses
         the grid cell of this raster to align all other rasters.
+    cache: RasterCache
+        On-disk cache of aligned, distance and normalized rasters, set with the :meth:`set_cache` method.
+    lazy_layers: dict[str, dict[str, dict]]
+        Source path and reading window of the raster layers added with ``lazy=True`` (see :meth:`add_layer`), by
+        category and name.
     """
 
     def __init__(self, project_crs: Optional[Union['pyproj.CRS', int]] = 3395,
@@ -129,12 +136,48 @@ class DataProcessor:
         self.mask_layer = None
         self.conn = None
         self.base_layer = None
+        self.cache = None
+        self.lazy_layers = {}
 
     def __setitem__(self, idx, value):
-        self.__dict__[idx] = value
+        setattr(self, idx, value)
 
     def __getitem__(self, idx):
-        return self.__dict__[idx]
+        return getattr(self, idx)
+
+    def __setstate__(self, state):
+        # models pickled before ``base_layer`` and ``mask_layer`` became properties store them under their own name
+        for attribute in ['base_layer', 'mask_layer']:
+            if attribute in state:
+                state['_' + attribute] = state.pop(attribute)
+        state['_base_mask_cache'] = None
+        self.__dict__.update(state)
+
+    @property
+    def base_layer(self) -> Optional[RasterLayer]:
+        """RasterLayer to use as template for all raster based data processes.
+
+        Setting a new layer resets the cached rasterized :attr:`mask_layer`.
+        """
+        return self._base_layer
+
+    @base_layer.setter
+    def base_layer(self, layer: Optional[RasterLayer]):
+        self._base_layer = layer
+        self._base_mask_cache = None
+
+    @property
+    def mask_layer(self) -> Optional[VectorLayer]:
+        """Layer used to mask all datasets.
+
+        Setting a new layer resets its cached rasterization on the grid of the :attr:`base_layer`.
+        """
+        return self._mask_layer
+
+    @mask_layer.setter
+    def mask_layer(self, layer: Optional[VectorLayer]):
+        self._mask_layer = layer
+        self._base_mask_cache = None
 
     def _get_layers(self, layers: dict[str, list[str]]) -> dict[str, dict[str, 'RasterLayer']]:
         """Gets the ``dict(category: dict(name: layer))`` dictionary from the :attr:`layers` attribute.
@@ -162,13 +205,15 @@ class DataProcessor:
                 _layers = layers
         return _layers
 
-    def set_postgres(self, dbname: str, user: str, password: str):
+    def set_postgres(self, dbname: str, user: str, password: str, host: Optional[str] = None,
+                     port: Optional[int] = None, max_connections: int = 4):
         """
-        Wrapper function to set a connection to a PostgreSQL database using the :doc:`psycopg2.connect<psycopg2:module>`
-        class.
+        Wrapper function to set a pool of connections to a PostgreSQL database using the
+        :doc:`psycopg2.pool.ThreadedConnectionPool<psycopg2:pool>` class.
 
-        It stores the connection into the :attr:`conn` attribute, which can be used to read layers directly from the
-        database.
+        It stores the pool into the :attr:`conn` attribute, which can be used to read layers directly from the
+        database. Every read takes a connection from the pool and returns it afterwards, so layers can be read
+        concurrently without opening a new connection each time.
 
         .. warning::
            The PostgreSQL database connection is only functional for vector layers. Compatibility with raster layers
@@ -182,16 +227,41 @@ class DataProcessor:
             User name of the postgres connection.
         password: str
             Password to authenticate the user.
+        host: str, optional
+            Database host address. If not defined the default of ``psycopg2`` is used (a local Unix socket).
+        port: int, optional
+            Connection port number. If not defined the default of ``psycopg2`` is used (5432).
+        max_connections: int, default 4
+            Maximum number of connections kept in the pool.
         """
-        self.conn = psycopg2.connect(dbname=dbname,
-                                     user=user,
-                                     password=password)
+        self.conn = ThreadedConnectionPool(1, max_connections,
+                                           dbname=dbname,
+                                           user=user,
+                                           password=password,
+                                           host=host,
+                                           port=port)
+
+    def set_cache(self, directory: str, max_size: int = 10 * 1024 ** 3):
+        """Sets an on-disk cache for the derived rasters.
+
+        Once set, the results of :meth:`align_layers`, :meth:`get_distance_rasters` and :meth:`normalize_rasters` are
+        stored in the ``directory`` and reused in later runs whenever the data of the layers, the base grid and the
+        parameters of the operation did not change.
+
+        Parameters
+        ----------
+        directory: str
+            Folder where the cached rasters are stored.
+        max_size: int, default 10 GB
+            Maximum size of the cache in bytes. The least recently used rasters are removed when it is exceeded.
+        """
+        self.cache = RasterCache(directory, max_size=max_size)
 
     def add_layer(self, path: str, layer_type: str, category: str = 'Other', name: str = None, query: str = None,
                   postgres: bool = False, base_layer: bool = False, resample: str = 'nearest',
                   normalization: str = 'MinMax', inverse: bool = False, distance_method: Optional[str] = None,
                   distance_limit: Optional[Callable[[np.ndarray], np.ndarray]] = None,
-                  window: Optional[bool] = False, rescale: bool = False):
+                  window: Optional[bool] = False, rescale: bool = False, lazy: bool = False):
         """Adds a new layer (type VectorLayer or RasterLayer) to the DataProcessor class
 
         Parameters
@@ -262,6 +332,15 @@ class DataProcessor:
             rescale the values of a cell proportionally to the change in size of the cell. This is useful when aligning
             rasters that have different cell sizes and their values can be scaled proportionally. See the ``rescale``
             parameter of :class:`RasterLayer`.
+        lazy: bool, default False
+            Whether to only register the layer instead of reading it. The data of a lazy layer is read, aligned and
+            masked in one go when it is needed (see :meth:`save_datasets`), and released once saved or once its
+            distance or normalized raster is computed (see :meth:`get_distance_rasters` and
+            :meth:`normalize_rasters`), so only one lazy layer is held in memory at a time. Lazy layers are skipped by :meth:`align_layers`,
+            :meth:`mask_layers` and :meth:`reproject_layers`.
+
+            .. note::
+               Only applicable for `raster` layers that are not the ``base_layer``.
 
         See also
         ----------
@@ -272,22 +351,24 @@ class DataProcessor:
         """
         if name is None:
             name = os.path.splitext(os.path.basename(path))[0]
+        # a layer added again replaces the lazy one registered under the same name, if any
+        self.lazy_layers.get(category, {}).pop(name, None)
 
         if layer_type == 'vector':
             if base_layer == True:
                 warn("A vector layer has been given as base_layer. The base_layer can only be of type raster. base_layer"
                      "for this layer has been set to False.", Warning, stacklevel=2)
+            if window:
+                window = self.mask_layer.data
+            else:
+                window = None
             if postgres:
                 layer = VectorLayer(category, name, path, conn=self.conn,
                                     normalization=normalization,
                                     distance_method=distance_method,
                                     distance_limit=distance_limit,
-                                    inverse=inverse, query=query)
+                                    inverse=inverse, query=query, bbox=window)
             else:
-                if window:
-                    window = self.mask_layer.data
-                else:
-                    window = None
                 layer = VectorLayer(category, name, path,
                                     normalization=normalization,
                                     distance_method=distance_method,
@@ -308,10 +389,18 @@ class DataProcessor:
                 window = bounds
             else:
                 window = None
-            layer = RasterLayer(category, name, path,
-                                normalization=normalization, inverse=inverse,
-                                distance_method=distance_method, resample=resample,
-                                window=window, rescale=rescale)
+            if lazy and not base_layer:
+                layer = RasterLayer(category, name,
+                                    normalization=normalization, inverse=inverse,
+                                    distance_method=distance_method, resample=resample,
+                                    rescale=rescale)
+                layer.path = path
+                self.lazy_layers.setdefault(category, {})[name] = {'path': path, 'window': window}
+            else:
+                layer = RasterLayer(category, name, path,
+                                    normalization=normalization, inverse=inverse,
+                                    distance_method=distance_method, resample=resample,
+                                    window=window, rescale=rescale)
 
             if base_layer:
                 if not self.cell_size:
@@ -384,6 +473,43 @@ class DataProcessor:
 
         except Exception:
             warn("The mask layer has to be vector polygon layer.", Warning, stacklevel=2)
+
+    def _is_lazy(self, category: str, name: str) -> bool:
+        """Checks whether a layer was added with ``lazy=True`` (see :meth:`add_layer`)."""
+        return name in getattr(self, 'lazy_layers', {}).get(category, {})
+
+    def _base_mask(self) -> np.ndarray:
+        """Gets a boolean array flagging the cells of the :attr:`base_layer` grid inside the :attr:`mask_layer`.
+
+        The mask is rasterized once and cached until the :attr:`mask_layer` or the :attr:`base_layer` are replaced,
+        or the grid of the base layer changes.
+        """
+        key = RasterLayer._grid_key(self.base_layer)
+        cached = self._base_mask_cache
+        if (cached is None) or (cached[0] != key):
+            mask_layer = self.mask_layer
+            if mask_layer.data.crs != self.base_layer.meta['crs']:
+                mask_layer = mask_layer.copy()
+                mask_layer.reproject(self.base_layer.meta['crs'])
+            rasterized_mask = mask_layer.rasterize(value=1, transform=self.base_layer.meta['transform'],
+                                                   width=self.base_layer.meta['width'],
+                                                   height=self.base_layer.meta['height'],
+                                                   nodata=0, all_touched=False)
+            cached = self._base_mask_cache = (key, rasterized_mask.data == 1)
+        return cached[1]
+
+    def _load_lazy_layer(self, category: str, name: str, layer: RasterLayer):
+        """Reads the data of a lazy layer from its source file onto the grid of the :attr:`base_layer`, masked with
+        the :attr:`mask_layer`, in a single warp (see :meth:`RasterLayer.warp_to`)."""
+        spec = self.lazy_layers[category][name]
+        if isinstance(self.base_layer, RasterLayer):
+            mask = self._base_mask() if isinstance(self.mask_layer, VectorLayer) else None
+            layer.warp_to(self.base_layer, path=spec['path'], mask=mask)
+        else:
+            layer.read_layer(spec['path'], window=spec['window'])
+            if isinstance(self.mask_layer, VectorLayer):
+                layer.mask(self.mask_layer, all_touched=False, crop=True)
+
     def _save_layers(self, save: bool, category: str, name: str):
         if save:
             output_path = os.path.join(self.output_directory,
@@ -393,7 +519,73 @@ class DataProcessor:
             output_path = None
         return output_path
 
-    def mask_layers(self, datasets: dict[str, list[str]] = 'all', crop: bool = True, save_layers: bool = False):
+    def _cached_raster(self, operation: str, key_items: list, compute: Callable[[], None],
+                       layer: Union[VectorLayer, RasterLayer], attribute: Optional[str] = None,
+                       output_path: Optional[str] = None):
+        """Runs ``compute`` unless its resulting raster is found in the :attr:`cache`.
+
+        The resulting raster is the ``layer`` itself if ``attribute`` is None, or the raster stored in that attribute
+        of the layer (e.g. ``distance_raster``) otherwise.
+        """
+        cache = getattr(self, 'cache', None)
+        if cache is None:
+            compute()
+            return
+
+        key = cache.key(operation, *key_items)
+        cached = cache.get(key)
+        if cached is None:
+            compute()
+            raster = layer if attribute is None else layer[attribute]
+            cache.put(key, raster.data, raster.meta, raster.name)
+            return
+
+        data, meta, name = cached
+        if attribute is None:
+            raster = layer
+        elif attribute == 'normalized':
+            raster = RasterLayer(category=layer.category, name=name)
+        else:
+            raster = RasterLayer(layer.category, name,
+                                 distance_limit=layer.distance_limit,
+                                 inverse=layer.inverse,
+                                 normalization=layer.normalization)
+        raster.data = data
+        raster.meta = meta
+        if attribute is not None:
+            layer[attribute] = raster
+        if output_path:
+            raster.save(output_path)
+
+    @staticmethod
+    def _process_layers(datasets: dict[str, dict[str, Union[VectorLayer, RasterLayer]]],
+                        function: Callable[[str, str, Union[VectorLayer, RasterLayer]], None],
+                        workers: Optional[int] = None):
+        """Applies a per-layer ``function(category, name, layer)`` to all layers in ``datasets``.
+
+        If ``workers`` is larger than 1, the layers are processed concurrently in a thread pool. If ``workers`` is
+        given, the progress is reported in the same order as the layers were given.
+        """
+        items = [(category, name, layer) for category, layers in datasets.items()
+                 for name, layer in layers.items()]
+
+        def progress(i, category, name):
+            if workers is not None:
+                print(f'    [{i + 1}/{len(items)}] {category} - {name}')
+
+        if (workers is None) or (workers <= 1):
+            for i, (category, name, layer) in enumerate(items):
+                function(category, name, layer)
+                progress(i, category, name)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(function, *item) for item in items]
+                for i, (future, (category, name, layer)) in enumerate(zip(futures, items)):
+                    future.result()
+                    progress(i, category, name)
+
+    def mask_layers(self, datasets: dict[str, list[str]] = 'all', crop: bool = True, save_layers: bool = False,
+                    workers: Optional[int] = None):
         """Uses the mask layer in ``self.mask_layer`` to mask layers to its boundaries.
 
         Parameters
@@ -411,6 +603,9 @@ class DataProcessor:
             Determines whether to crop the masked layers extent to the mask layers extent.
         save_layers: boolean, default False
             Determines whether to save the reprojected layer to disc or not.
+        workers: int, optional
+            Number of threads used to mask the layers concurrently. If not defined, the layers are masked one after
+            the other. If defined, the progress is printed.
 
         See also
         ----------
@@ -420,24 +615,29 @@ class DataProcessor:
             raise Exception('The `mask_layer` attribute is empty, please first ' + \
                             'add a mask layer using the `.add_mask_layer` method.')
         datasets = self._get_layers(datasets)
-        for category, layers in datasets.items():
-            for name, layer in layers.items():
-                output_path = self._save_layers(save=save_layers, category=category, name=name)
-                if name != self.base_layer.name:
-                    all_touched = False
-                else:
-                    all_touched = False
-                if isinstance(layer, RasterLayer):
-                    layer.mask(self.mask_layer, output_path, all_touched=all_touched, crop=crop)
-                elif isinstance(layer, VectorLayer):
-                    layer.mask(self.mask_layer, output_path)
 
-                if isinstance(layer.friction, RasterLayer):
-                    layer.friction.mask(self.mask_layer, output_path, crop=crop)
-                if isinstance(layer.distance_raster, RasterLayer):
-                    layer.distance_raster.mask(self.mask_layer, output_path, crop=crop)
+        def mask_layer(category, name, layer):
+            if self._is_lazy(category, name):
+                return
+            output_path = self._save_layers(save=save_layers, category=category, name=name)
+            if name != self.base_layer.name:
+                all_touched = False
+            else:
+                all_touched = False
+            if isinstance(layer, RasterLayer):
+                layer.mask(self.mask_layer, output_path, all_touched=all_touched, crop=crop)
+            elif isinstance(layer, VectorLayer):
+                layer.mask(self.mask_layer, output_path)
+
+            if isinstance(layer.friction, RasterLayer):
+                layer.friction.mask(self.mask_layer, output_path, crop=crop)
+            if isinstance(layer.distance_raster, RasterLayer):
+                layer.distance_raster.mask(self.mask_layer, output_path, crop=crop)
+
+        self._process_layers(datasets, mask_layer, workers=workers)
 
-    def align_layers(self, datasets: dict[str, list[str]] = 'all', save_layers=False):
+    def align_layers(self, datasets: dict[str, list[str]] = 'all', save_layers=False,
+                     workers: Optional[int] = None):
         """Ensures that the coordinate system and resolution of the raster is the same as the base layer
 
         Parameters
@@ -453,6 +653,9 @@ class DataProcessor:
 
         save_layers: boolean, default False
             Determines whether to save the reprojected layer to disc or not.
+        workers: int, optional
+            Number of threads used to align the layers concurrently. If not defined, the layers are aligned one after
+            the other. If defined, the progress is printed.
 
         See also
         ----------
@@ -460,19 +663,29 @@ class DataProcessor:
         """
 
         datasets = self._get_layers(datasets)
-        for category, layers in datasets.items():
-            for name, layer in layers.items():
-                output_path = self._save_layers(save=save_layers, category=category, name=name)
-                if isinstance(layer, VectorLayer):
-                    if isinstance(layer.friction, RasterLayer):
-                        layer.friction.align(base_layer=self.base_layer, output_path=output_path)
-                else:
-                    if name != self.base_layer.name:
-                        layer.align(base_layer=self.base_layer, output_path=output_path)
-                    if isinstance(layer.friction, RasterLayer):
-                        layer.friction.align(base_layer=self.base_layer, output_path=output_path)
 
-    def reproject_layers(self, datasets: dict[str, list[str]] = 'all', save_layers=False):
+        def align(raster, output_path):
+            self._cached_raster('align', [raster, self.base_layer.meta, raster.resample, raster.rescale],
+                                lambda: raster.align(base_layer=self.base_layer, output_path=output_path),
+                                raster, output_path=output_path)
+
+        def align_layer(category, name, layer):
+            if self._is_lazy(category, name):
+                return
+            output_path = self._save_layers(save=save_layers, category=category, name=name)
+            if isinstance(layer, VectorLayer):
+                if isinstance(layer.friction, RasterLayer):
+                    align(layer.friction, output_path)
+            else:
+                if name != self.base_layer.name:
+                    align(layer, output_path)
+                if isinstance(layer.friction, RasterLayer):
+                    align(layer.friction, output_path)
+
+        self._process_layers(datasets, align_layer, workers=workers)
+
+    def reproject_layers(self, datasets: dict[str, list[str]] = 'all', save_layers=False,
+                         workers: Optional[int] = None):
         """Reprojects all layers entered.
 
         Parameters
@@ -488,6 +701,9 @@ class DataProcessor:
 
         save_layers: boolean, default False
             Determines whether to save the reprojected layer to disc or not.
+        workers: int, optional
+            Number of threads used to reproject the layers concurrently. If not defined, the layers are reprojected
+            one after the other. If defined, the progress is printed.
 
         See also
         --------
@@ -495,14 +711,19 @@ class DataProcessor:
         VectorLayer.reproject
         """
         datasets = self._get_layers(datasets)
-        for category, layers in datasets.items():
-            for name, layer in layers.items():
-                output_path = self._save_layers(save=save_layers, category=category, name=name)
-                layer.reproject(self.project_crs, output_path)
-                if isinstance(layer.friction, RasterLayer):
-                    layer.friction.reproject(self.project_crs, output_path)
 
-    def get_distance_rasters(self, datasets: Union[str, dict] = "all", save_layers: bool =False):
+        def reproject_layer(category, name, layer):
+            if self._is_lazy(category, name):
+                return
+            output_path = self._save_layers(save=save_layers, category=category, name=name)
+            layer.reproject(self.project_crs, output_path)
+            if isinstance(layer.friction, RasterLayer):
+                layer.friction.reproject(self.project_crs, output_path)
+
+        self._process_layers(datasets, reproject_layer, workers=workers)
+
+    def get_distance_rasters(self, datasets: Union[str, dict] = "all", save_layers: bool =False,
+                             workers: Optional[int] = None):
         """Calls the `.distance_raster` method of all the layers entered.
 
         The function calculates the distance either as proximity or as traveltime see `RasterLayer.get_distance_raster`
@@ -521,6 +742,9 @@ class DataProcessor:
 
         save_layer: bool, default False
             Determines whether to save the distance raster to disc or not.
+        workers: int, optional
+            Number of threads used to calculate the distance rasters concurrently. If not defined, the distance
+            rasters are calculated one after the other. If defined, the progress is printed.
 
         See also
         --------
@@ -528,14 +752,31 @@ class DataProcessor:
         VectorLayer.get_distance_raster
         """
         datasets = self._get_layers(datasets)
-        for category, layers in datasets.items():
-            for name, layer in layers.items():
-                output_path = self._save_layers(save=save_layers, category=category, name=name)
-                if isinstance(layer, VectorLayer):
-                    layer.get_distance_raster(raster=self.base_layer,
-                                              output_path=output_path)
-                if isinstance(layer, RasterLayer):
+
+        def distance_raster(category, name, layer):
+            release = self._is_lazy(category, name) and layer.data is None
+            if release:
+                self._load_lazy_layer(category, name, layer)
+            output_path = self._save_layers(save=save_layers, category=category, name=name)
+            if isinstance(layer, VectorLayer):
+                self._cached_raster('distance', [layer, layer.distance_method, self.base_layer, layer.friction],
+                                    lambda: layer.get_distance_raster(raster=self.base_layer,
+                                                                      output_path=output_path),
+                                    layer, attribute='distance_raster', output_path=output_path)
+            if isinstance(layer, RasterLayer):
+                if layer.distance_method in ['log', 'travel_time']:
+                    self._cached_raster('distance', [layer, layer.distance_method, self.mask_layer,
+                                                     layer.starting_points],
+                                        lambda: layer.get_distance_raster(output_path=output_path,
+                                                                          mask_layer=self.mask_layer),
+                                        layer, attribute='distance_raster', output_path=output_path)
+                else:
                     layer.get_distance_raster(output_path=output_path, mask_layer=self.mask_layer)
+            # layers used as their own distance raster keep their data
+            if release and layer.distance_raster is not layer:
+                layer.data = None
+
+        self._process_layers(datasets, distance_raster, workers=workers)
 
 
     def normalize_rasters(self, datasets: Union[str, dict] = "all", buffer: bool =False, save_layers: bool =False):
@@ -568,11 +809,19 @@ class DataProcessor:
         datasets = self._get_layers(datasets)
         for category, layers in datasets.items():
             for name, layer in layers.items():
+                release = self._is_lazy(category, name) and layer.data is None
+                if release:
+                    self._load_lazy_layer(category, name, layer)
                 output_path = self._save_layers(save=save_layers, category=category, name=name)
                 layer.mask(self.mask_layer, crop=False, all_touched=False)
-                layer.normalize(output_path, buffer=buffer, inverse=layer.inverse)
-
-    def save_datasets(self, datasets: Union[str, dict] = "all"):
+                self._cached_raster('normalize', [layer, layer.normalization, layer.distance_limit, buffer,
+                                                  layer.inverse],
+                                    lambda: layer.normalize(output_path, buffer=buffer, inverse=layer.inverse),
+                                    layer, attribute='normalized', output_path=output_path)
+                if release and layer.distance_raster is not layer:
+                    layer.data = None
+
+    def save_datasets(self, datasets: Union[str, dict] = "all", vector_format: str = 'geojson'):
         """Saves layers.
 
         Saves any layer that is given as input in parameter ``datasets``
@@ -588,6 +837,14 @@ class DataProcessor:
                 datasets={'category_1': ['layer_1', 'layer_2'],
                           'category_2': [...]}
 
+        vector_format: str, default 'geojson'
+            File format used to save the vector layers, either ``'geojson'`` or ``'parquet'``. See
+            :meth:`VectorLayer.save`.
+
+        Notes
+        -----
+        Lazy layers (see :meth:`add_layer`) that are not loaded yet are read, aligned, masked and saved one at a
+        time, and their data is released right after being saved.
         """
         datasets = self._get_layers(datasets)
         if self.mask_layer.category not in datasets.keys():
@@ -601,7 +858,15 @@ class DataProcessor:
                 output_path = os.path.join(self.output_directory,
                                            category, name)
                 os.makedirs(output_path, exist_ok=True)
-                layer.save(output_path)
+                release = self._is_lazy(category, name) and layer.data is None
+                if release:
+                    self._load_lazy_layer(category, name, layer)
+                if isinstance(layer, VectorLayer):
+                    layer.save(output_path, file_format=vector_format)
+                else:
+                    layer.save(output_path)
+                if release:
+                    layer.data = None
                 for raster in ['distance_raster', 'normalized']:
                     if layer[raster] is not None:
                         output_path = os.path.join(self.output_directory,
@@ -1159,6 +1424,7 @@ class OnStove(DataProcessor):
         self.clean_cooking_access_r = None
         self.electrified_weight = None
         self.tech_separator = 'and'
+        self.frictions = {}
 
         self.specs = {'startyear': 2020, 'endyear': 2020,
                       'endyeartarget': 1.0, 'mealsperday': 3.0, 'infraweight': 1.0,
@@ -1169,6 +1435,39 @@ class OnStove(DataProcessor):
 
         self.gdf = gpd.GeoDataFrame()
 
+    def get_friction(self, path: str) -> RasterLayer:
+        """Gets a friction layer from the registry of the model, reading it only the first time it is requested.
+
+        Technologies using the same friction file (e.g. LPG, the collected biomass stoves and biogas) share the same
+        :class:`RasterLayer`, so the file is read and preprocessed once. The friction layers also keep the graph and
+        the travel time maps calculated with :meth:`RasterLayer.travel_time`, so technologies with the same starting
+        points share one solve.
+
+        Parameters
+        ----------
+        path: str
+            Path to the friction raster file describing the time needed (in minutes) to travel one meter within each
+            cell.
+
+        Returns
+        -------
+        RasterLayer
+            The friction layer.
+        """
+        if not hasattr(self, 'frictions'):
+            # models pickled before the registry existed
+            self.frictions = {}
+        key = os.path.abspath(path)
+        if key not in self.frictions:
+            self.frictions[key] = RasterLayer('Friction', 'Friction', path=path, resample='average')
+        return self.frictions[key]
+
+    def __getstate__(self):
+        # the registry of friction layers (see :meth:`get_friction`) is not saved, they are read again when needed
+        state = self.__dict__.copy()
+        state['frictions'] = {}
+        return state
+
     def read_scenario_data(self, path_to_config: str, delimiter=','):
         """Reads the scenario data into a dictionary.
 
@@ -1783,11 +2082,13 @@ class OnStove(DataProcessor):
         self.gdf.loc[isurban, "Calibrated_pop"] = self.gdf.loc[isurban, "Pop"] * calibration_factor_u
 
     def distance_to_electricity(self, hv_lines: VectorLayer = None, mv_lines: VectorLayer = None,
-                                transformers: VectorLayer = None):
+                                transformers: VectorLayer = None, max_distance: Optional[float] = None):
         """ Calculates the distance to electricity infrastructure.
 
         It calls the :meth:`VectorLayer.get_distance_raster` method for the high voltage, medium voltage and
         transformers datasets (if available) and converts the output to a column in the main GeoDataFrame (:attr:`gdf`).
+        For layers using the ``proximity`` distance method, the distance is only calculated for the populated cells
+        (see :meth:`VectorLayer.proximity_at`) instead of for the whole grid.
 
         .. warning::
            The ``name`` attribute of the input datasets must be `HV_lines`, `MV_lines` and `Transformers`. This
@@ -1801,13 +2102,21 @@ class OnStove(DataProcessor):
             Medium voltage lines dataset.
         transformers: VectorLayer
             Transformers dataset.
+        max_distance: float, optional
+            Maximum distance in meters to search for the infrastructure. Farther settlements get this distance. Only
+            used with the ``proximity`` distance method.
         """
         if (not hv_lines) and (not mv_lines) and (not transformers):
             raise ValueError("You MUST provide at least one of the following datasets: hv_lines, mv_lines or "
                              "transformers.")
 
         for layer in [hv_lines, mv_lines, transformers]:
-            if layer:
+            if layer and (layer.distance_method == 'proximity'):
+                distance = layer.proximity_at(self.base_layer, self.rows, self.cols, max_distance=max_distance)
+                if max_distance is not None:
+                    distance = np.minimum(distance, max_distance)
+                self.gdf[layer.name + '_dist'] = distance / 1000  # to convert from meters to km
+            elif layer:
                 layer.get_distance_raster(raster=self.base_layer)
                 layer.distance_raster.data /= 1000  # to convert from meters to km
                 self.raster_to_dataframe(layer.distance_raster,
@@ -1849,7 +2158,8 @@ class OnStove(DataProcessor):
                                      'Pop': data[self.rows, self.cols]})
         self.gdf.crs = self.project_crs
 
-    def raster_to_dataframe(self, layer: Union[RasterLayer, str], name: Optional[str] = None, method: str = 'sample',
+    def raster_to_dataframe(self, layer: Union[RasterLayer, str, dict[str, Union[RasterLayer, str]]],
+                            name: Optional[str] = None, method: str = 'sample',
                             fill_nodata_method: Optional[str] = None,
                             fill_default_value: Union[float, int] = 0):
         """
@@ -1863,12 +2173,14 @@ class OnStove(DataProcessor):
 
         Parameters
         ----------
-        layer: RasterLayer or path to the raster
+        layer: RasterLayer, path to the raster or dictionary
             Raster layer to extract values from. If the method ``sample`` is used, this must be provided as the
-            path to the raster file.
+            path to the raster file. A dictionary of column names and layers can be used to extract several layers at
+            once: their values are gathered in a single block and added as columns to the :attr:`gdf`. With the
+            ``read`` method all the layers of the dictionary must have the same shape.
         name: str, optional
             Name to use for the column of the extracted data in the :attr:`gdf`. If name is not given the raster data
-            will be returned as a numpy array.
+            will be returned as a numpy array. Ignored if a dictionary of layers is given.
         method: str, default 'sample'
             Method to use when extracting the data. If ``sample``, the values will be sampled using the coordinates of
             the point of the GeoDataFrame (:attr:`gdf`), which have been previously defined by the population layer.If
@@ -1882,50 +2194,148 @@ class OnStove(DataProcessor):
             radius (currently 100) if the ``interpolate`` method is selected, ignored if ``nearest`` is selected
             and for all the nodata values if ``None`` is used as method.
         """
-        data = None
-        if method == 'sample':
-            with rasterio.open(layer) as src:
-                if src.meta['crs'] != self.gdf.crs:
-                    data = sample_raster(layer, self.gdf.to_crs(src.meta['crs']))
-                else:
-                    data = sample_raster(layer, self.gdf)
-        elif method == 'read':
-            layer = raster_setter(layer)
-            if 'nodata' in layer.meta.keys():
-                nodata = layer.meta['nodata']
-            else:
-                nodata = np.nan
-            layer = layer.data.copy().astype(float)
-            if fill_nodata_method is not None:
-                layer[layer == nodata] = np.nan
-                if np.isnan(layer[self.rows, self.cols]).sum() > 0:
-                    if fill_nodata_method == 'interpolate':
-                        mask = ~np.isnan(layer)
-                        layer = fillnodata(layer, mask=mask, max_search_distance=100)
-                        layer[(~mask) & (np.isnan(layer))] = fill_default_value
-                    elif fill_nodata_method == 'nearest':
-                        nodata_mask = np.isnan(layer)
-                        x, y = np.meshgrid(np.arange(layer.shape[1]), np.arange(layer.shape[0]))
-                        x_flat = x.flatten()
-                        y_flat = y.flatten()
-                        data_flat = layer.flatten()
-                        x_interpolate = x_flat[~nodata_mask.flatten()]
-                        y_interpolate = y_flat[~nodata_mask.flatten()]
-                        data_interpolate = data_flat[~nodata_mask.flatten()]
-                        data_interpolated = griddata((x_interpolate, y_interpolate),
-                                                     data_interpolate,
-                                                     (x, y),
-                                                     method='nearest')
-                        layer = np.where(nodata_mask, data_interpolated, layer)
+        if fill_nodata_method not in [None, 'interpolate', 'nearest']:
+            raise NotImplementedError('fill_nodata can only be None, "interpolate" or "nearest"')
+
+        layers = layer if isinstance(layer, dict) else {name: layer}
+        data = np.empty((len(self.gdf) if method == 'sample' else len(self.rows), len(layers)))
+        cells = None
+        for i, item in enumerate(layers.values()):
+            if method == 'sample':
+                with rasterio.open(item) as src:
+                    if src.meta['crs'] != self.gdf.crs:
+                        data[:, i] = sample_raster(item, self.gdf.to_crs(src.meta['crs']))
                     else:
-                        raise NotImplementedError('fill_nodata can only be None, "interpolate" or "nearest"')
+                        data[:, i] = sample_raster(item, self.gdf)
+            elif method == 'read':
+                item = raster_setter(item)
+                if cells is None:
+                    # flat index of the populated cells, shared by all the layers
+                    shape = item.data.shape
+                    cells = np.ravel_multi_index((self.rows, self.cols), shape)
+                elif item.data.shape != shape:
+                    raise ValueError(f'All the layers read at once must have the same shape, got {item.data.shape} '
+                                     f'and {shape}. Align them with the population layer first.')
+                data[:, i] = item.data.take(cells)
+                if fill_nodata_method is not None:
+                    missing = ~item.validity_mask.take(cells)
+                    if missing.any():
+                        data[missing, i] = self._fill_values(item, self.rows[missing], self.cols[missing],
+                                                             fill_nodata_method, fill_default_value)
+            else:
+                data = None
+                break
 
-            data = layer[self.rows, self.cols]
+        if isinstance(layer, dict):
+            if data is not None:
+                self.gdf[list(layers)] = data
+            return
+        if data is not None:
+            data = data[:, 0]
         if name:
             self.gdf[name] = data
         else:
             return data
 
+    def _fill_values(self, layer: RasterLayer, rows: np.ndarray, cols: np.ndarray, fill_nodata_method: str,
+                     fill_default_value: Union[float, int]) -> np.ndarray:
+        """Gets the values used to fill the given nodata cells of the layer (see :meth:`raster_to_dataframe`)."""
+        if fill_nodata_method == 'interpolate':
+            values = self._interpolate_valid(layer.data, layer.validity_mask, rows, cols)
+            values[np.isnan(values)] = fill_default_value
+            return values
+        nearest = self._nearest_valid(layer.validity_mask, rows, cols)
+        if nearest is None:
+            return np.full(len(rows), fill_default_value, dtype=float)
+        return layer.data[nearest]
+
+    @staticmethod
+    def _nearest_valid(valid: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """Finds the nearest valid cell (in euclidean distance) of each of the given cells.
+
+        Only the valid cells bordering nodata cells are searched, as the nearest valid cell of a nodata cell always
+        has a nodata neighbour.
+
+        Parameters
+        ----------
+        valid: np.ndarray
+            Boolean array flagging the valid cells of the raster.
+        rows: np.ndarray
+            Rows of the cells to search for.
+        cols: np.ndarray
+            Columns of the cells to search for.
+
+        Returns
+        -------
+        tuple of np.ndarray or None
+            Rows and columns of the nearest valid cells, or None if the raster has no valid cells.
+        """
+        border = valid & ~ndimage.binary_erosion(valid, structure=np.ones((3, 3), dtype=bool), border_value=1)
+        border_rows, border_cols = np.nonzero(border)
+        if border_rows.size == 0:
+            return None
+        tree = scipy.spatial.cKDTree(np.column_stack([border_rows, border_cols]))
+        _, idx = tree.query(np.column_stack([rows, cols]), workers=-1)
+        return border_rows[idx], border_cols[idx]
+
+    @staticmethod
+    def _interpolate_valid(data: np.ndarray, valid: np.ndarray, rows: np.ndarray, cols: np.ndarray,
+                           max_search_distance: int = 100, block_size: int = 512) -> np.ndarray:
+        """Interpolates the values of the given nodata cells from the valid cells around them.
+
+        It uses the inverse distance weighting of :func:`rasterio.fill.fillnodata`, but only over the blocks of the
+        raster that contain any of the cells, padded with ``max_search_distance`` cells so that the results match
+        filling the whole raster. If the padded blocks would cover more cells than the bounding window of all the
+        cells, this window is filled at once instead.
+
+        Parameters
+        ----------
+        data: np.ndarray
+            Data of the raster.
+        valid: np.ndarray
+            Boolean array flagging the valid cells of the raster.
+        rows: np.ndarray
+            Rows of the cells to interpolate.
+        cols: np.ndarray
+            Columns of the cells to interpolate.
+        max_search_distance: int, default 100
+            Maximum number of cells to search in all directions to find values to interpolate from.
+        block_size: int, default 512
+            Size (in cells) of the blocks in which the raster is split.
+
+        Returns
+        -------
+        np.ndarray
+            The interpolated values, `np.nan` for the cells without valid cells within the search distance.
+        """
+        values = np.full(len(rows), np.nan)
+        height, width = valid.shape
+
+        def window(idx):
+            return (idx, slice(max(rows[idx].min() - max_search_distance - 1, 0),
+                               min(rows[idx].max() + max_search_distance + 2, height)),
+                    slice(max(cols[idx].min() - max_search_distance - 1, 0),
+                          min(cols[idx].max() + max_search_distance + 2, width)))
+
+        def area(w):
+            return (w[1].stop - w[1].start) * (w[2].stop - w[2].start)
+
+        blocks = (rows // block_size) * (-(-width // block_size)) + cols // block_size
+        windows = [window(np.nonzero(blocks == block)[0]) for block in np.unique(blocks)]
+        # when the cells are spread all over the raster, padding every block costs more than a single fill
+        single = window(np.arange(len(rows)))
+        if sum(area(w) for w in windows) >= area(single):
+            windows = [single]
+
+        for idx, row_window, col_window in windows:
+            mask = valid[row_window, col_window]
+            if not mask.any():
+                continue
+            filled = fillnodata(np.where(mask, data[row_window, col_window], np.nan).astype(float), mask=mask,
+                                max_search_distance=max_search_distance)
+            values[idx] = filled[rows[idx] - row_window.start, cols[idx] - col_window.start]
+        return values
+
     def calibrate_urban_rural_split(self, GHS_path: str):
         """Calibrates the urban rural split using spatial data from the
         `GHS SMOD dataset <https://ghsl.jrc.ec.europa.eu/download.php?ds=smod>`_.
@@ -3923,6 +4333,17 @@ class OnStove(DataProcessor):
 
         return p
 
+    def to_parquet(self, name: str):
+        """Saves the main GeoDataFrame :attr:`gdf` as a GeoParquet file into the :attr:`output_directory`.
+
+        Parameters
+        ----------
+        name: str
+            Name of the file.
+        """
+        name = os.path.join(self.output_directory, name + '.parquet')
+        self.gdf.to_parquet(name, write_covering_bbox=True)
+
     def to_csv(self, name: str):
         """Saves the main GeoDataFrame :attr:`gdf` as a ``.csv`` file into the :attr:`output_directory`.
 
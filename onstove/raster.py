@@ -1,12 +1,21 @@
 import glob
 import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
 
 import fiona
 import numpy as np
 
 import rasterio
 import rasterio.mask
+from rasterio.crs import CRS
+from rasterio.dtypes import dtype_rev, typename_fwd
+from rasterio.io import MemoryFile
 from rasterio.merge import merge
+from rasterio.transform import from_origin
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.enums import Resampling as enumsResampling
 
@@ -46,8 +55,71 @@ def align_raster(raster_1, raster_2, method='nearest', compression='DEFLATE'):
 #         dest.write_band(1, arr_filled)
 
 
+def decompress_raster(raster_path, cache_dir=None, max_size=10 * 1024 ** 3):
+    """
+    Decompresses a gzipped raster into a cache directory and returns the path to the decompressed file.
+
+    The cached file is named after a hash of the absolute path of the compressed file and a hash of its size and
+    modification time, so repeated calls with the same input reuse the decompressed copy. When a modified input is
+    decompressed, the stale copy of the previous version is removed. When the total size of the cache exceeds
+    ``max_size`` (in bytes), the least recently used files are removed. If no ``cache_dir`` is given, an
+    ``onstove_cache`` folder in the temporary directory of the system is used.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'onstove_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    stat = os.stat(raster_path)
+    path_key = hashlib.sha1(os.path.abspath(raster_path).encode()).hexdigest()
+    version_key = hashlib.sha1(f'{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+    name = os.path.basename(raster_path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    cached_file = os.path.join(cache_dir, f'{path_key}_{version_key}_{name}')
+
+    if os.path.exists(cached_file):
+        # marks the entry as recently used
+        os.utime(cached_file)
+    else:
+        # decompress into a temporary file first so an interrupted run does not leave a corrupted cache entry
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix='tmp', delete=False) as tmp:
+            with gzip.open(raster_path) as gzip_infile:
+                shutil.copyfileobj(gzip_infile, tmp, length=16 * 1024 * 1024)
+        os.replace(tmp.name, cached_file)
+        _evict_decompressed(cache_dir, cached_file, path_key, max_size)
+    return cached_file
+
+
+def _evict_decompressed(cache_dir, cached_file, path_key, max_size):
+    """Removes the stale copies of ``cached_file`` and the least recently used files above ``max_size``."""
+    entries = []
+    for file in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file)
+        # files being decompressed by other processes are skipped
+        if file.startswith('tmp') or path == cached_file:
+            continue
+        try:
+            if file.startswith(path_key + '_'):
+                os.remove(path)
+            else:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            pass
+
+    total = os.path.getsize(cached_file) + sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
 def mask_raster(raster_path, mask_layer, output_file, nodata=0, compression='NONE',
-                all_touched=False):
+                all_touched=False, cache_dir=None):
     if isinstance(mask_layer, str):
         with fiona.open(mask_layer, "r") as shapefile:
             shapes = [feature["geometry"] for feature in shapefile]
@@ -57,16 +129,12 @@ def mask_raster(raster_path, mask_layer, output_file, nodata=0, compression='NON
         crs = mask_layer.crs
 
     if '.gz' in raster_path:
-        with gzip.open(raster_path) as gzip_infile:
-            with rasterio.open(gzip_infile) as src:
-                out_image, out_transform = rasterio.mask.mask(src, shapes, crop=True, nodata=nodata,
-                                                              all_touched=all_touched)
-                out_meta = src.meta
-    else:
-        with rasterio.open(raster_path) as src:
-            out_image, out_transform = rasterio.mask.mask(src, shapes, crop=True, nodata=nodata,
-                                                          all_touched=all_touched)
-            out_meta = src.meta
+        raster_path = decompress_raster(raster_path, cache_dir=cache_dir)
+
+    with rasterio.open(raster_path) as src:
+        out_image, out_transform = rasterio.mask.mask(src, shapes, crop=True, nodata=nodata,
+                                                      all_touched=all_touched)
+        out_meta = src.meta
 
     out_meta.update({"driver": "GTiff",
                      "height": out_image.shape[1],
@@ -141,23 +209,149 @@ def reproject_raster(raster_path, dst_crs,
 
 
 def sample_raster(path, gdf):
+    """
+    Samples the first band of a raster at the point locations of a GeoDataFrame.
+
+    The row and column of every point are computed at once with the inverse affine transform of the raster, and
+    only the blocks of the raster that contain points are read. Points falling outside the raster get the nodata
+    value of the raster (or 0 if it is not defined).
+    """
+    xs = gdf['geometry'].x.to_numpy()
+    ys = gdf['geometry'].y.to_numpy()
     with rasterio.open(path) as src:
-        return [float(val) for val in src.sample([(x.coords.xy[0][0],
-                                                   x.coords.xy[1][0]) for x in
-                                                  gdf['geometry']])]
+        cols, rows = ~src.transform * (xs, ys)
+        rows = np.floor(rows).astype(int)
+        cols = np.floor(cols).astype(int)
+        fill = src.nodata if src.nodata is not None else 0
+        data = np.full(xs.shape, fill, dtype='float64')
 
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        rows = rows[inside]
+        cols = cols[inside]
+        values = np.empty(rows.shape, dtype='float64')
+
+        block_height, block_width = src.block_shapes[0]
+        blocks = (rows // block_height) * int(np.ceil(src.width / block_width)) + cols // block_width
+        order = np.argsort(blocks, kind='stable')
+        _, starts = np.unique(blocks[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for start, end in zip(starts, ends):
+            idx = order[start:end]
+            row_off = (rows[idx[0]] // block_height) * block_height
+            col_off = (cols[idx[0]] // block_width) * block_width
+            window = rasterio.windows.Window(col_off, row_off,
+                                             min(block_width, src.width - col_off),
+                                             min(block_height, src.height - row_off))
+            block = src.read(1, window=window)
+            values[idx] = block[rows[idx] - row_off, cols[idx] - col_off]
+
+        data[inside] = values
+    return data
 
-def merge_rasters(files_path, dst_crs, outpul_file):
-    files = glob.glob(files_path)
-    src_files_to_mosaic = []
 
+def _build_vrt(files, dst_crs):
+    """Builds the xml of a GDAL VRT mosaicking the first band of ``files`` on the grid of the first file.
+
+    Where files overlap the first one in the list has priority, as in :func:`rasterio.merge.merge`.
+    """
+    sources = []
+    bounds = []
     for fp in files:
-        src = rasterio.open(fp)
-        src_files_to_mosaic.append(src)
+        with rasterio.open(fp) as src:
+            sources.append((os.path.abspath(fp), src.bounds, src.width, src.height, src.nodata))
+            bounds.append(src.bounds)
+            if len(sources) == 1:
+                res_x, res_y = src.res
+                dtype = src.dtypes[0]
+                nodata = src.nodata
+
+    left = min(b.left for b in bounds)
+    bottom = min(b.bottom for b in bounds)
+    right = max(b.right for b in bounds)
+    top = max(b.top for b in bounds)
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+    transform = from_origin(left, top, res_x, res_y)
+
+    xml = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+           f'  <SRS>{escape(CRS.from_user_input(dst_crs).to_wkt())}</SRS>',
+           f'  <GeoTransform>{", ".join(repr(v) for v in transform.to_gdal())}</GeoTransform>',
+           f'  <VRTRasterBand dataType="{typename_fwd[dtype_rev[dtype]]}" band="1">']
+    if nodata is not None:
+        xml.append(f'    <NoDataValue>{nodata!r}</NoDataValue>')
+    # later sources are drawn on top of earlier ones in a VRT, so they are listed in reverse order
+    for path, src_bounds, src_width, src_height, src_nodata in reversed(sources):
+        xml += ['    <ComplexSource>',
+                f'      <SourceFilename relativeToVRT="0">{escape(path)}</SourceFilename>',
+                '      <SourceBand>1</SourceBand>',
+                f'      <SrcRect xOff="0" yOff="0" xSize="{src_width}" ySize="{src_height}"/>',
+                f'      <DstRect xOff="{(src_bounds.left - left) / res_x!r}" '
+                f'yOff="{(top - src_bounds.top) / res_y!r}" '
+                f'xSize="{(src_bounds.right - src_bounds.left) / res_x!r}" '
+                f'ySize="{(src_bounds.top - src_bounds.bottom) / res_y!r}"/>']
+        if src_nodata is not None:
+            xml.append(f'      <NODATA>{src_nodata!r}</NODATA>')
+        xml.append('    </ComplexSource>')
+    xml += ['  </VRTRasterBand>', '</VRTDataset>']
+    return '\n'.join(xml)
+
+
+def merge_rasters(files_path, dst_crs, outpul_file, method='merge', compression='DEFLATE'):
+    """Merges all rasters matching ``files_path`` into a single raster.
+
+    Parameters
+    ----------
+    files_path: str
+        Glob pattern matching the rasters to merge.
+    dst_crs: int or str
+        Coordinate reference system assigned to the merged raster.
+    outpul_file: str
+        Path of the output file.
+    method: str, default 'merge'
+        Either ``'merge'`` or ``'vrt'``. With ``'merge'`` the full mosaic is read into memory using
+        :func:`rasterio.merge.merge`. With ``'vrt'`` a GDAL virtual raster is built over the input files; if the
+        ``outpul_file`` ends in ``.vrt`` the virtual raster itself is saved, so it can be read later by window
+        (e.g. with ``RasterLayer(window=...)``), otherwise it is copied block by block into a tiled GeoTIFF.
+    compression: str, default 'DEFLATE'
+        Compression used for the GeoTIFF written with the ``'vrt'`` method.
+
+    Returns
+    -------
+    str
+        Path of the output file.
+    """
+    files = glob.glob(files_path)
+
+    if method == 'vrt':
+        vrt = _build_vrt(files, dst_crs)
+        if outpul_file.lower().endswith('.vrt'):
+            with open(outpul_file, 'w') as f:
+                f.write(vrt)
+            return outpul_file
+
+        with MemoryFile(vrt.encode(), ext='vrt') as memfile:
+            with memfile.open() as src:
+                out_meta = src.meta.copy()
+                out_meta.update({"driver": "GTiff",
+                                 "tiled": True,
+                                 "blockxsize": 512,
+                                 "blockysize": 512,
+                                 "compress": compression})
+                with rasterio.open(outpul_file, "w", **out_meta) as dest:
+                    for _, window in dest.block_windows(1):
+                        dest.write(src.read(1, window=window), indexes=1, window=window)
+        return outpul_file
+    elif method != 'merge':
+        raise ValueError("The method should be either 'merge' or 'vrt'.")
 
-    mosaic, out_trans = merge(src_files_to_mosaic)
+    src_files_to_mosaic = [rasterio.open(fp) for fp in files]
+    try:
+        mosaic, out_trans = merge(src_files_to_mosaic)
+        out_meta = src_files_to_mosaic[-1].meta.copy()
+    finally:
+        for src in src_files_to_mosaic:
+            src.close()
 
-    out_meta = src.meta.copy()
     out_meta.update({"driver": "GTiff",
                      "height": mosaic[0].shape[0],
                      "width": mosaic[0].shape[1],
@@ -167,6 +361,7 @@ def merge_rasters(files_path, dst_crs, outpul_file):
                     )
     with rasterio.open(outpul_file, "w", **out_meta) as dest:
         dest.write(mosaic[0], indexes=1)
+    return outpul_file
 
 
 def normalize(raster=None, limit=None, output_file=None,
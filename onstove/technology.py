@@ -871,11 +871,13 @@ class LPG(Technology):
                 raise ValueError('A path to a friction raster layer must be passed or stored in the `friction_path`'
                                  ' attribute.')
 
-        friction = RasterLayer(self.name, 'Friction', path=friction_path, resample='average')
+        friction = model.get_friction(friction_path)
 
         if align:
             os.makedirs(os.path.join(model.output_directory, self.name, 'Suppliers'), exist_ok=True)
             lpg.reproject(model.base_layer.meta['crs'], os.path.join(model.output_directory, self.name, 'Suppliers'))
+            # the friction layer is shared with other technologies (see :meth:`onstove.OnStove.get_friction`)
+            friction = friction.copy()
             friction.align(model.base_layer.path, os.path.join(model.output_directory, self.name, 'Friction'))
 
         lpg.friction = friction
@@ -1281,14 +1283,16 @@ class Biomass(Technology):
             :class:`onstove.OnStove`.
         """
         self.forest = RasterLayer(self.name, 'Forest', path=forest_path, resample='mode')
-        self.friction = RasterLayer(self.name, 'Friction', path=friction_path, resample='average')
+        self.friction = model.get_friction(friction_path)
 
         self.forest.friction = self.friction
         rows, cols = self.forest.start_points(condition=self.forest_condition)
-        self.friction.travel_time(rows=rows, cols=cols, include_starting_cells=True, create_raster=True)
+        # the round trip is capped to 7 hours below, so the search can stop at half of it
+        # the friction layer is shared with other technologies, so the travel time is not stored in it
+        distance_raster = self.friction.travel_time(rows=rows, cols=cols, include_starting_cells=True,
+                                                    create_raster=False, max_cost=3.5)
 
-        travel_time = 2 * model.raster_to_dataframe(self.friction.distance_raster,
-                                                    fill_nodata_method='interpolate', method='read')
+        travel_time = 2 * model.raster_to_dataframe(distance_raster, fill_nodata_method='interpolate', method='read')
         travel_time[travel_time > 7] = 7  # cap to max travel time based on literature
         self.travel_time = travel_time
 
@@ -2125,7 +2129,7 @@ class Biogas(Technology):
         -------
         A pandas series with the values for each populated grid cell in hours per meter
         """
-        friction = RasterLayer(self.name, 'Friction', path=friction_path, resample='average')
+        friction = model.get_friction(friction_path)
         data = model.raster_to_dataframe(friction, fill_nodata_method='interpolate', method='read')
         return data / 60
 
@@ -2255,11 +2259,8 @@ class Biogas(Technology):
             'Pigs': pigs,
             'Sheeps': sheeps}
 
-        for name, path in paths.items():
-            layer = RasterLayer('Livestock', name,
-                                path=path)
-            model.raster_to_dataframe(layer, name=name, method='read',
-                                      fill_nodata_method='interpolate')
+        layers = {name: RasterLayer('Livestock', name, path=path) for name, path in paths.items()}
+        model.raster_to_dataframe(layers, method='read', fill_nodata_method='interpolate')
 
     def total_time(self, model: 'onstove.OnStove'):
         """This method expands :meth:`Technology.total_time` by adding the biogas collection time
@@ -1,6 +1,13 @@
 # test for layer.py module
 import os
 import pytest
+import numpy as np
+import geopandas as gpd
+import rasterio
+import shapely
+import psycopg2.pool
+from psycopg2 import sql
+from unittest import mock
 from onstove.layer import VectorLayer, RasterLayer
 
 
@@ -107,6 +114,124 @@ def test_mask_vector(sample_vector_layer, sample_raster_layer, output_path):
     assert os.path.exists(name)
 
 
+def test_mask_vector_layer():
+    """Test for clipping a vector layer with a mask layer"""
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    mask_layer = VectorLayer(
+        path=os.path.join(rwa_path, "Administrative", "Country_boundaries", "Country_boundaries.geojson")
+    )
+    mask_layer.reproject(3857)
+    lines = VectorLayer(path=os.path.join(rwa_path, "Electricity", "MV_lines", "MV_lines.geojson"))
+    expected = gpd.clip(lines.data, mask_layer.data.to_crs(lines.data.crs)).sort_index()
+
+    lines.mask(mask_layer)
+    assert len(lines.data) == len(expected)
+    assert lines.data.geometry.geom_equals(expected.geometry).all()
+    assert len(mask_layer._mask_geometry_cache) == 1
+    # copies (e.g. reprojected by other threads masking with the same layer) do not iterate the cache
+    assert mask_layer.copy()._mask_geometry_cache == {}
+
+    # reassigning the data resets the cached geometry, even if the new dataframe has the same length and crs
+    mask_layer.data = mask_layer.data.set_geometry(mask_layer.data.translate(xoff=1000))
+    assert mask_layer._mask_geometry_cache == {}
+    assert mask_layer._mask_geometry(3857).equals(shapely.union_all(mask_layer.data.geometry.values))
+
+
+def test_parquet_vector(output_path):
+    """Test for saving and reading a vector layer as GeoParquet
+
+    Parameters
+    ----------
+    output_path: str
+                Output path.
+    """
+
+    pytest.importorskip("pyarrow")
+    lines = VectorLayer(
+        name="MV_lines",
+        path=os.path.join("onstove", "tests", "tests_data", "RWA", "Electricity", "MV_lines", "MV_lines.geojson")
+    )
+    lines.save(output_path, file_format="parquet")
+    assert lines.path == os.path.join(output_path, "MV_lines.parquet")
+
+    parquet = VectorLayer(path=lines.path)
+    assert parquet.data.crs == lines.data.crs
+    assert parquet.data.geometry.geom_equals(lines.data.geometry).all()
+
+    bbox = gpd.GeoDataFrame(geometry=[shapely.box(29.5, -2.2, 30.0, -1.8)], crs=4326)
+    expected = VectorLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Electricity", "MV_lines",
+                                             "MV_lines.geojson"), bbox=bbox)
+    filtered = VectorLayer(path=lines.path, bbox=bbox, columns=["source"])
+    assert list(filtered.data.columns) == ["source", "geometry"]
+    assert len(filtered.data) == len(expected.data)
+
+    # files written without a bounding box column are filtered after reading
+    plain_path = os.path.join(output_path, "MV_lines_plain.parquet")
+    lines.data.to_parquet(plain_path)
+    plain = VectorLayer(path=plain_path, bbox=bbox, columns=["source"])
+    assert list(plain.data.columns) == ["source", "geometry"]
+    assert plain.data.geometry.geom_equals(filtered.data.geometry).all()
+
+
+def _sql_string(query):
+    """Renders a composed SQL query as a string without a database connection"""
+    if isinstance(query, sql.Composed):
+        return "".join(_sql_string(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join('"%s"' % s for s in query.strings)
+    return query.string
+
+
+def test_read_postgis():
+    """Test for reading a PostGIS table in chunks from a mocked connection pool"""
+
+    points = [shapely.Point(29.6 + i / 10, -2) for i in range(3)]
+    cursors = []
+
+    def cursor(name=None):
+        cur = mock.MagicMock()
+        cur.__enter__.return_value = cur
+        if name is None:
+            cur.fetchone.return_value = (4326,)
+        else:
+            cur.description = [("name",), ("geom",)]
+            cur.fetchmany.side_effect = [[("a", points[0].wkb), ("b", points[1].wkb)], [("c", points[2].wkb)], []]
+        cursors.append((name, cur))
+        return cur
+
+    connection = mock.MagicMock()
+    connection.cursor.side_effect = cursor
+    pool = mock.create_autospec(psycopg2.pool.ThreadedConnectionPool, instance=True)
+    pool.getconn.return_value = connection
+    bbox = gpd.GeoDataFrame(geometry=[shapely.box(29.5, -2.2, 30.0, -1.8)], crs=4326)
+
+    data = VectorLayer._read_postgis("public.roads", pool, bbox=bbox, columns=["name"], chunk_size=2)
+    assert list(data["name"]) == ["a", "b", "c"]
+    assert data.crs == 4326
+    assert data.geometry.geom_equals(gpd.GeoSeries(points, crs=4326)).all()
+
+    name, cur = cursors[1]
+    query, params = cur.execute.call_args.args
+    assert _sql_string(query) == ('SELECT "name", "geom" FROM "public"."roads" '
+                                  'WHERE ST_Intersects("geom", ST_MakeEnvelope(%s, %s, %s, %s, %s))')
+    assert np.allclose(params, [29.5, -2.2, 30.0, -1.8, 4326])
+    assert cur.itersize == 2
+    connection.rollback.assert_called_once()
+    pool.putconn.assert_called_once_with(connection)
+
+    # every read opens its own named cursor
+    VectorLayer._read_postgis("public.roads", pool, chunk_size=2)
+    names = [name for name, _ in cursors if name is not None]
+    assert len(names) == 2 and names[0] != names[1]
+
+    # the transaction of a connection given by the user is left open
+    connection.reset_mock()
+    VectorLayer._read_postgis("public.roads", connection, chunk_size=2)
+    connection.rollback.assert_not_called()
+    cursors[-1][1].__exit__.assert_called_once()
+
+
 def test_reproject_vector(sample_vector_layer, output_path):
     """Test to reproject vector layer
 
@@ -164,6 +289,25 @@ def test_proximity_vector(sample_vector_layer, sample_raster_layer, output_path)
     assert isinstance(prox, RasterLayer)
 
 
+def test_proximity_at():
+    """Test for the bounded proximity of a vector layer at given cells"""
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    population = RasterLayer(path=os.path.join(rwa_path, "Demographics", "Population", "Population.tif"))
+    lines = VectorLayer(path=os.path.join(rwa_path, "Electricity", "MV_lines", "MV_lines.geojson"))
+    lines.reproject(population.meta["crs"])
+    rows, cols = np.where(population.data > 1)
+
+    expected = lines.proximity(population, create_raster=False).data[rows, cols]
+    distances = lines.proximity_at(population, rows, cols)
+    assert distances.dtype == np.float32
+    assert np.allclose(distances, expected)
+
+    distances = lines.proximity_at(population, rows, cols, max_distance=5000)
+    assert np.allclose(distances[expected <= 5000], expected[expected <= 5000])
+    assert np.isinf(distances[expected > 5000]).all()
+
+
 def test_rasterize(sample_vector_layer, output_path):
     """Test to rasterize vector layers
 
@@ -194,23 +338,87 @@ def test_rasterize(sample_vector_layer, output_path):
     ), RasterLayer
 
 
-"""#Note: does not work for all vector types. Mentioned in layer module.
+def test_rasterize_tiles(output_path):
+    """Test to rasterize vector layers by tiles
+
+    Parameters
+    ----------
+    output_path: str
+                Output path.
+    """
+
+    lines = VectorLayer(
+        name="MV_lines",
+        path=os.path.join("onstove", "tests", "tests_data", "RWA", "Electricity", "MV_lines", "MV_lines.geojson")
+    )
+    expected = lines.rasterize(cell_width=500, cell_height=500)
+    tiled = lines.rasterize(cell_width=500, cell_height=500, tile_size=32, workers=2)
+    assert np.array_equal(tiled.data, expected.data)
+
+    saved = lines.rasterize(cell_width=500, cell_height=500, tile_size=32, workers=2,
+                            output_path=os.path.join(output_path, "rasterize_tiles"))
+    assert saved.data is None
+    with rasterio.open(saved.path) as src:
+        assert src.block_shapes == [(32, 32)]
+        assert np.array_equal(src.read(1), expected.data)
+
+
+def test_start_points_vector(sample_raster_layer):
+    """Test for getting the starting cells of a point layer
+
+    Parameters
+    ----------
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    """
+
+    meta = sample_raster_layer.meta
+    rows = np.array([0, 3, 3, meta["height"] - 1])
+    cols = np.array([0, 2, 2, meta["width"] - 1])
+    x, y = rasterio.transform.xy(meta["transform"], rows, cols)
+    # add a point outside the grid
+    x = np.append(x, sample_raster_layer.bounds[2] + 1000)
+    y = np.append(y, sample_raster_layer.bounds[3])
+
+    points = VectorLayer()
+    points.data = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=meta["crs"])
+    start_rows, start_cols = points.start_points(raster=sample_raster_layer)
+    assert start_rows.dtype.kind == "i"
+    assert set(zip(start_rows, start_cols)) == {(0, 0), (3, 2), (meta["height"] - 1, meta["width"] - 1)}
+    assert len(start_rows) == 3
+
+
 def test_travel_time_vector(sample_vector_layer, sample_raster_layer, output_path):
-    # assert len(sample_raster_layer.data) > 0
-    
+    """Test for creating a travel time map from a polygon layer
+
+    Parameters
+    ----------
+    sample_vector_layer: Vector Layer
+                Instance of Vector Layer class.
+                See :class:`onstove.VectorLayer`.
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    output_path: str
+                Output path.
+    """
+
     path = os.path.join(
         output_path,
         "travel_time"
     )
+    rows, cols = sample_vector_layer.start_points(raster=sample_raster_layer)
+    assert len(rows) > 0
 
     least_cost_travel_time = sample_vector_layer.travel_time(
         friction=sample_raster_layer,
         output_path=path,
-        create_raster=True,
+        create_raster=False,
     )
 
     assert isinstance(least_cost_travel_time, RasterLayer)
-"""
+    assert (least_cost_travel_time.data[rows, cols] == 0).all()
 
 
 # Raster Layer test functions
@@ -276,6 +484,134 @@ def test_travel_time(sample_raster_layer):
     assert isinstance(sample_raster_layer, RasterLayer)
 
 
+def test_travel_time_max_cost():
+    """Test for creating a travel time map bounded by a maximum cost"""
+
+    friction = RasterLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction",
+                                             "Friction.tif"))
+    rows, cols = np.where(friction.validity_mask)
+    rows, cols = rows[::200], cols[::200]
+    full = friction.travel_time(rows=rows, cols=cols, create_raster=False).data
+    bounded = friction.travel_time(rows=rows, cols=cols, create_raster=False, max_cost=0.5).data
+
+    reached = full <= 0.5
+    assert np.allclose(bounded[reached], full[reached])
+    assert np.all(bounded[full > 0.5] == 0.5)
+    assert np.isnan(bounded[~friction.validity_mask]).all()
+
+
+def test_travel_time_tiles():
+    """Test for creating a travel time map solving the cost surface by tiles"""
+
+    friction = RasterLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction",
+                                             "Friction.tif"))
+    rows, cols = np.where(friction.validity_mask)
+    rows, cols = rows[::500], cols[::500]
+    full = friction.travel_time(rows=rows, cols=cols, create_raster=False).data
+    tiled = friction.travel_time(rows=rows, cols=cols, create_raster=False, tile_size=16, workers=2).data
+    assert np.array_equal(np.isnan(tiled), np.isnan(full))
+    assert np.allclose(tiled[~np.isnan(full)], full[~np.isnan(full)])
+
+    # a single process solves the tiles one by one, with the same result
+    seeds = np.ravel_multi_index((rows, cols), friction.data.shape)
+    tiled = friction._tiled_travel_time(seeds, 16)
+    tiled[np.isinf(tiled)] = np.nan
+    assert np.allclose(tiled[~np.isnan(full)], full[~np.isnan(full)])
+
+    # without workers the tiles are not worth it for a surface that fits in memory
+    with pytest.warns(UserWarning, match="tile_size"):
+        friction.travel_time(rows=rows, cols=cols, create_raster=False, tile_size=16)
+    with pytest.raises(ValueError):
+        friction.travel_time(rows=rows, cols=cols, create_raster=False, tile_size=16, workers=2, catchment=True)
+
+
+def test_travel_time_cache():
+    """Test for the bounded cache of travel time solves"""
+
+    friction = RasterLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction",
+                                             "Friction.tif"))
+    friction.travel_cache_size = 2
+    rows, cols = np.where(friction.validity_mask)
+    first = friction.travel_time(rows=rows[:1], cols=cols[:1], create_raster=False)
+    for i in range(1, 4):
+        friction.travel_time(rows=rows[i:i + 1], cols=cols[i:i + 1], create_raster=False)
+        assert len(friction._travel_results) <= 2
+
+    # evicted solves are computed again with the same result
+    again = friction.travel_time(rows=rows[:1], cols=cols[:1], create_raster=False)
+    assert np.array_equal(again.data, first.data, equal_nan=True)
+    assert len(friction._travel_results) == 2
+
+
+def test_travel_time_catchment():
+    """Test for getting the catchment of the starting points of a travel time map"""
+
+    friction = RasterLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction",
+                                             "Friction.tif"))
+    rows, cols = np.where(friction.validity_mask)
+    rows, cols = rows[::300], cols[::300]
+    x, y = rasterio.transform.xy(friction.meta["transform"], rows, cols)
+    suppliers = VectorLayer(name="Suppliers")
+    suppliers.data = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=friction.meta["crs"])
+
+    travel_time, catchment = suppliers.travel_time(friction=friction, create_raster=False, catchment=True)
+    assert catchment.data.dtype == np.int32
+    assert np.array_equal(catchment.data[rows, cols], np.arange(len(rows)))
+
+    # every cell is reached from the supplier with the lowest travel time
+    single = np.stack([friction.travel_time(rows=[r], cols=[c], create_raster=False).data
+                       for r, c in zip(rows, cols)])
+    reached = ~np.isnan(travel_time.data)
+    r, c = np.where(reached)
+    assert np.allclose(single[catchment.data[reached], r, c], travel_time.data[reached])
+    assert np.all(catchment.data[~reached] == -1)
+
+
+def test_travel_time_restrictions():
+    """Test for excluding restricted areas from a travel time map"""
+
+    friction = RasterLayer(path=os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction",
+                                             "Friction.tif"))
+    original = friction.data.copy()
+    rows, cols = np.where(friction.validity_mask)
+    rows, cols = rows[::500], cols[::500]
+    x, y = rasterio.transform.xy(friction.meta["transform"], rows, cols)
+    suppliers = VectorLayer(name="Suppliers")
+    suppliers.data = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=friction.meta["crs"])
+    unrestricted = suppliers.travel_time(friction=friction, create_raster=False)
+
+    left, bottom, right, top = rasterio.transform.array_bounds(friction.meta["height"], friction.meta["width"],
+                                                               friction.meta["transform"])
+    area = VectorLayer(name="Park")
+    area.data = gpd.GeoDataFrame(geometry=[shapely.box(left, bottom, (left + right) / 2, (bottom + top) / 2)],
+                                 crs=friction.meta["crs"])
+    suppliers.add_restricted_areas(area)
+    restricted = suppliers.travel_time(friction=friction, create_raster=False)
+
+    mask = area._restriction_mask(friction)
+    assert area._restriction_mask(friction) is mask
+    assert mask.any()
+    assert np.all(np.isnan(restricted.data[mask]))
+    assert np.all(np.nan_to_num(restricted.data[~mask], nan=np.inf) >=
+                  np.nan_to_num(unrestricted.data[~mask], nan=np.inf))
+    assert np.array_equal(friction.data, original, equal_nan=True)
+    # the restricted cost surface and graph are not kept after the solve
+    assert set(friction._travel_cache) <= {"cost", "graph", "csgraph"}
+
+    # raster restrictions are cached per grid and reset when their data is reassigned
+    protected = RasterLayer(name="Protected")
+    protected.meta = friction.meta.copy()
+    protected.data = mask.astype(friction.data.dtype)
+    assert np.array_equal(protected._restriction_mask(friction), mask)
+    assert protected._restriction_mask(friction) is protected._restriction_mask(friction)
+    protected.data = np.zeros_like(protected.data)
+    assert not protected._restriction_mask(friction).any()
+
+    # scenarios without restrictions are not affected
+    assert np.array_equal(suppliers.travel_time(friction=friction, create_raster=False, restrictions=[]).data,
+                          unrestricted.data, equal_nan=True)
+
+
 def test_log(sample_vector_layer, sample_raster_layer, output_path):
     """Test for log(logarithmic representation of raster surface)
 
@@ -311,6 +647,27 @@ def test_proximity(sample_raster_layer):
     assert isinstance(raster_prox, RasterLayer)
 
 
+def test_warp_to():
+    """Test for reading a raster directly onto the grid of a base layer"""
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    base = RasterLayer(path=os.path.join(rwa_path, "Demographics", "Population", "Population.tif"))
+    base.reproject(3395, cell_width=900, cell_height=900)
+    path = os.path.join(rwa_path, "Electricity", "Night_time_lights", "Night_time_lights.tif")
+
+    for rescale in [False, True]:
+        aligned = RasterLayer(path=path, resample="average", rescale=rescale)
+        aligned.align(base)
+        warped = RasterLayer(resample="average", rescale=rescale)
+        warped.warp_to(base, path=path)
+        assert warped.data.shape == base.data.shape
+        assert np.array_equal(warped.validity_mask, aligned.validity_mask)
+        assert np.allclose(warped.data[warped.validity_mask], aligned.data[aligned.validity_mask], rtol=1e-6)
+
+    warped.warp_to(base, path=path, mask=base.validity_mask)
+    assert not warped.validity_mask[~base.validity_mask].any()
+
+
 def test_align(sample_raster_layer, output_path):
     """Test for raster alignment
 
@@ -361,3 +718,77 @@ def test_normalize(sample_raster_layer, output_path):
     )
     assert sample_raster_layer.normalized is not None
     assert os.path.join(path, "normalized", "-normalized.tif"), RasterLayer
+
+
+def test_validity_mask(sample_raster_layer):
+    """Test for the cached validity mask of the raster
+
+    Parameters
+    ----------
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    """
+
+    data = sample_raster_layer.data
+    nodata = sample_raster_layer.meta["nodata"]
+    expected = (data != nodata) & ~np.isnan(data)
+    assert np.array_equal(sample_raster_layer.validity_mask, expected)
+    assert sample_raster_layer.validity_mask is sample_raster_layer.validity_mask
+
+    new_nodata = data[expected][0]
+    sample_raster_layer.meta["nodata"] = new_nodata
+    assert np.array_equal(sample_raster_layer.validity_mask, expected & (data != new_nodata))
+
+    sample_raster_layer.data = np.full(data.shape, new_nodata)
+    assert not sample_raster_layer.validity_mask.any()
+
+    layer_copy = sample_raster_layer.copy()
+    assert np.array_equal(layer_copy.data, sample_raster_layer.data)
+    assert not layer_copy.validity_mask.any()
+
+
+def test_cumulative_count(sample_raster_layer):
+    """Test for the cumulative count of the raster
+
+    Parameters
+    ----------
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    """
+
+    values = np.sort(sample_raster_layer.data[sample_raster_layer.validity_mask])
+    count = values.shape[0]
+    layer = sample_raster_layer.cumulative_count([0.02, 0.98])
+    assert np.nanmin(layer) == values[int(count * 0.02)]
+    assert np.nanmax(layer) == values[int(count * 0.98)]
+    assert np.array_equal(np.isnan(layer), ~sample_raster_layer.validity_mask)
+    assert ('cumulative_count', (0.02, 0.98)) in sample_raster_layer._stats_cache
+
+    layer = sample_raster_layer.cumulative_count([0, 1])
+    assert np.nanmax(layer) == values[-1]
+
+
+def test_quantiles(sample_raster_layer):
+    """Test for the quantile classification of the raster
+
+    Parameters
+    ----------
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    """
+
+    quantiles = [0.25, 0.5, 0.75, 1]
+    classes = sample_raster_layer.quantile_classes(quantiles, chunk_size=5)
+    assert classes.dtype == np.uint8
+    assert np.array_equal(classes == 255, ~sample_raster_layer.validity_mask)
+
+    layer = sample_raster_layer.quantiles(quantiles)
+    qs = sample_raster_layer.get_quantiles(quantiles)
+    data = sample_raster_layer.data
+    valid = sample_raster_layer.validity_mask
+    assert np.all(layer[valid & (data < qs[0])] == 25)
+    assert np.all(layer[valid & (data >= qs[2])] == 100)
+    assert np.isnan(layer[~valid]).all()
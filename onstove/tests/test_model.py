@@ -1,9 +1,17 @@
 # Test for models.py
 import os
+import pickle
+import shutil
+import numpy as np
+from scipy import ndimage
+import rasterio
+from rasterio.fill import fillnodata
 import geopandas as gpd
+import shapely
 import pytest
 from onstove.model import DataProcessor, MCA, OnStove
 from onstove.layer import VectorLayer, RasterLayer
+from onstove._cache import RasterCache
 
 
 @pytest.fixture
@@ -186,6 +194,216 @@ def test_mask_layers(data_object, sample_raster_layer):
     assert data_object.layers is not None
 
 
+def test_align_layers_workers(data_object, capsys):
+    """Test for aligning layers concurrently
+
+    Parameters
+    ----------
+    data_object: Model
+                Instance of Model class.
+    capsys: pytest.CaptureFixture
+                Captures the progress printed while processing the layers.
+    """
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    data_object.add_mask_layer(
+        category='Administrative',
+        name='Country_boundaries',
+        path=os.path.join(rwa_path, "Administrative", "Country_boundaries", "Country_boundaries.geojson")
+    )
+    data_object.add_layer(
+        category='Demographics',
+        name='Population',
+        path=os.path.join(rwa_path, "Demographics", "Population", "Population.tif"),
+        layer_type='raster',
+        base_layer=True,
+        resample='sum'
+    )
+    data_object.add_layer(
+        category='Demographics',
+        name='Urban',
+        path=os.path.join(rwa_path, "Demographics", "Urban", "Urban.tif"),
+        layer_type='raster'
+    )
+    data_object.add_layer(
+        category='Electricity',
+        name='Night_time_lights',
+        path=os.path.join(rwa_path, "Electricity", "Night_time_lights", "Night_time_lights.tif"),
+        layer_type='raster',
+        resample='average'
+    )
+    data_object.align_layers(datasets='all', workers=2)
+    capsys.readouterr()
+    data_object.mask_layers(datasets='all', workers=2)
+    parallel = capsys.readouterr().out
+    for category, layers in data_object.layers.items():
+        for name, layer in layers.items():
+            assert layer.data.shape == data_object.base_layer.data.shape
+
+    # the progress is reported the same way when the layers are processed one after the other
+    data_object.mask_layers(datasets='all', workers=1)
+    assert capsys.readouterr().out == parallel
+    assert '[3/3] Electricity - Night_time_lights' in parallel
+    # and only if workers are given
+    data_object.mask_layers(datasets='all')
+    assert capsys.readouterr().out == ''
+
+
+def test_lazy_layers(output_path):
+    """Test for processing lazy layers when saving the datasets
+
+    Parameters
+    ----------
+    output_path: str
+                Path to the output folder.
+    """
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    expected = {}
+    for lazy in [False, True]:
+        data = DataProcessor(project_crs=3857, cell_size=(1000, 1000))
+        data.output_directory = os.path.join(output_path, "lazy" if lazy else "eager")
+        data.add_mask_layer(category='Administrative', name='Country_boundaries',
+                            path=os.path.join(rwa_path, "Administrative", "Country_boundaries",
+                                              "Country_boundaries.geojson"))
+        data.add_layer(category='Demographics', name='Population',
+                       path=os.path.join(rwa_path, "Demographics", "Population", "Population.tif"),
+                       layer_type='raster', base_layer=True, resample='sum')
+        data.add_layer(category='Electricity', name='Night_time_lights',
+                       path=os.path.join(rwa_path, "Electricity", "Night_time_lights", "Night_time_lights.tif"),
+                       layer_type='raster', resample='average', lazy=lazy)
+        layer = data.layers['Electricity']['Night_time_lights']
+        assert (layer.data is None) == lazy
+
+        data.align_layers(datasets='all')
+        data.mask_layers(datasets='all')
+        data.save_datasets(datasets='all')
+        saved = RasterLayer(path=os.path.join(data.output_directory, "Electricity", "Night_time_lights",
+                                              "Night_time_lights.tif"))
+        expected[lazy] = saved.data
+        if lazy:
+            assert layer.data is None
+            assert saved.data.shape == data.base_layer.data.shape
+            # the rasterized mask is reused until the mask layer is replaced
+            mask = data._base_mask()
+            assert data._base_mask() is mask
+            data.mask_layer = data.mask_layer.copy()
+            assert data._base_mask_cache is None
+            assert np.array_equal(data._base_mask(), mask)
+
+            # adding the layer again without lazy replaces the lazy one
+            data.add_layer(category='Electricity', name='Night_time_lights',
+                           path=os.path.join(rwa_path, "Electricity", "Night_time_lights", "Night_time_lights.tif"),
+                           layer_type='raster', resample='average')
+            assert not data._is_lazy('Electricity', 'Night_time_lights')
+            data.add_layer(category='Electricity', name='Night_time_lights',
+                           path=os.path.join(rwa_path, "Electricity", "Night_time_lights", "Night_time_lights.tif"),
+                           layer_type='raster', resample='average', lazy=True)
+            layer = data.layers['Electricity']['Night_time_lights']
+            assert data._is_lazy('Electricity', 'Night_time_lights')
+
+            # derived rasters of lazy layers do not keep the source data in memory
+            layer.distance_method = 'log'
+            data.get_distance_rasters(datasets={'Electricity': ['Night_time_lights']})
+            assert layer.data is None
+            assert layer.distance_raster.data.shape == data.base_layer.data.shape
+            data.normalize_rasters(datasets={'Electricity': ['Night_time_lights']})
+            assert layer.data is None
+            assert layer.normalized.data.shape == data.base_layer.data.shape
+
+    assert np.array_equal(expected[False], expected[True], equal_nan=True)
+    shutil.rmtree(os.path.join(output_path, "lazy"))
+    shutil.rmtree(os.path.join(output_path, "eager"))
+
+
+def test_cache_key(output_path):
+    """Test for the keys of the on-disk cache of derived rasters
+
+    Parameters
+    ----------
+    output_path: str
+                Output path.
+    """
+
+    global DISTANCE_LIMIT
+    cache = RasterCache(os.path.join(output_path, "cache_key"))
+    limit = lambda x: x < DISTANCE_LIMIT
+    DISTANCE_LIMIT = 1000
+    key = cache.key('distance', limit)
+    assert cache.key('distance', limit) == key
+    DISTANCE_LIMIT = 2000
+    assert cache.key('distance', limit) != key
+
+    lines = gpd.GeoDataFrame(geometry=[shapely.LineString([(i, 0) for i in range(10000)]), shapely.Point(0, 0)],
+                             crs=3857)
+    assert cache.key(lines) != cache.key(lines.iloc[::-1])
+
+    # restricted areas of the layer or of its friction change the travel time
+    suppliers = VectorLayer(name="Suppliers")
+    suppliers.data = gpd.GeoDataFrame(geometry=[shapely.Point(0, 0)], crs=3857)
+    friction = RasterLayer(name="Friction")
+    friction.data = np.ones((10, 10))
+    friction.meta = {"crs": 3857, "transform": rasterio.transform.from_origin(0, 10, 1, 1), "nodata": -1}
+    park = VectorLayer(name="Park")
+    park.data = gpd.GeoDataFrame(geometry=[shapely.box(2, 2, 5, 5)], crs=3857)
+    key = cache.key('distance', suppliers, friction)
+    suppliers.add_restricted_areas(park)
+    restricted = cache.key('distance', suppliers, friction)
+    assert restricted != key
+    park.data = gpd.GeoDataFrame(geometry=[shapely.box(2, 2, 6, 6)], crs=3857)
+    assert cache.key('distance', suppliers, friction) != restricted
+    suppliers.restrictions = []
+    friction.add_restricted_areas(park)
+    assert cache.key('distance', suppliers, friction) not in [key, restricted]
+    shutil.rmtree(os.path.join(output_path, "cache_key"))
+
+
+def test_cache(output_path):
+    """Test for the on-disk cache of derived rasters
+
+    Parameters
+    ----------
+    output_path: str
+                Output path.
+    """
+
+    rwa_path = os.path.join("onstove", "tests", "tests_data", "RWA")
+    cache_path = os.path.join(output_path, "cache")
+    shutil.rmtree(cache_path, ignore_errors=True)
+
+    distance_rasters = []
+    for _ in range(2):
+        data = DataProcessor(project_crs=3857, cell_size=(1000, 1000))
+        data.set_cache(cache_path)
+        data.add_mask_layer(
+            category='Administrative',
+            name='Country_boundaries',
+            path=os.path.join(rwa_path, "Administrative", "Country_boundaries", "Country_boundaries.geojson")
+        )
+        data.add_layer(
+            category='Demographics',
+            name='Population',
+            path=os.path.join(rwa_path, "Demographics", "Population", "Population.tif"),
+            layer_type='raster',
+            base_layer=True,
+            resample='sum'
+        )
+        data.add_layer(
+            category='Electricity',
+            name='MV_lines',
+            path=os.path.join(rwa_path, "Electricity", "MV_lines", "MV_lines.geojson"),
+            layer_type='vector',
+            distance_method='proximity'
+        )
+        data.get_distance_rasters(datasets={'Electricity': ['MV_lines']})
+        distance_rasters.append(data.layers['Electricity']['MV_lines'].distance_raster)
+
+    assert len([file for file in os.listdir(cache_path) if file.endswith('.npy')]) == 1
+    assert distance_rasters[1].name == distance_rasters[0].name
+    assert distance_rasters[1].meta['transform'] == distance_rasters[0].meta['transform']
+    assert (distance_rasters[1].data == distance_rasters[0].data).all()
+
+
 def test_get_distance_rasters(data_object):
     """Test for get distance rasters function
 
@@ -226,6 +444,36 @@ def test_to_pickle(model_object, output_path):
 
 
 # OnStove
+def test_get_friction(model_object):
+    """Test for the friction layer registry of the model
+
+    Parameters
+    ----------
+    model_object: Model
+                Instance of Model class.
+    """
+
+    path = os.path.join("onstove", "tests", "tests_data", "RWA", "Biomass", "Friction", "Friction.tif")
+    friction = model_object.get_friction(path)
+    assert model_object.get_friction(os.path.abspath(path)) is friction
+
+    rows, cols = np.array([10, 20]), np.array([10, 30])
+    first = friction.travel_time(rows=rows, cols=cols, create_raster=False)
+    graph = friction._travel_graph()
+    second = model_object.get_friction(path).travel_time(rows=rows, cols=cols, create_raster=False)
+    assert friction._travel_graph() is graph
+    assert np.array_equal(first.data, second.data, equal_nan=True)
+    assert first.data is not second.data
+
+    friction.data = friction.data
+    assert not friction._travel_cache
+
+    # the registry is left out of the pickled model, without being cleared on the live model
+    restored = pickle.loads(pickle.dumps(model_object))
+    assert restored.frictions == {}
+    assert model_object.get_friction(path) is friction
+
+
 def test_read_scenario_data(model_object):
     """Test for read scenario data function
 
@@ -449,3 +697,101 @@ def test_raster_to_dataframe(model_object):
     )
     assert isinstance(model_object.gdf, gpd.GeoDataFrame)
     assert model_object.gdf["Night_lights"] is not None
+
+
+def test_raster_to_dataframe_nearest(model_object):
+    """Test for filling the nodata cells with the nearest valid cell in the raster to dataframe function
+
+    Parameters
+    ----------
+    model_object: Model
+                Instance of Model class.
+    """
+
+    path = os.path.join("onstove", "tests", "tests_data", "RWA", "Demographics", "Population", "Population.tif")
+    model_object.add_layer(category="Demographics", name="Population", path=path, layer_type="raster",
+                           base_layer=True)
+    model_object.population_to_dataframe()
+
+    # every cell gets a unique value, so the filled values identify the cells they were taken from
+    layer = RasterLayer(name="Cells")
+    layer.data = np.arange(model_object.base_layer.data.size, dtype=float).reshape(model_object.base_layer.data.shape)
+    layer.meta = dict(model_object.base_layer.meta, nodata=np.nan)
+    missing = np.arange(len(model_object.rows)) % 4 == 0
+    layer.data[model_object.rows[missing], model_object.cols[missing]] = np.nan
+
+    data = model_object.raster_to_dataframe(layer, method="read", fill_nodata_method="nearest")
+    assert np.array_equal(data[~missing], layer.data[model_object.rows[~missing], model_object.cols[~missing]])
+    rows, cols = np.unravel_index(data[missing].astype(int), layer.data.shape)
+    distances = np.hypot(rows - model_object.rows[missing], cols - model_object.cols[missing])
+    expected = ndimage.distance_transform_edt(np.isnan(layer.data))[model_object.rows[missing],
+                                                                    model_object.cols[missing]]
+    assert np.allclose(distances, expected)
+
+
+def test_raster_to_dataframe_interpolate(model_object):
+    """Test for interpolating the nodata cells only around the needed cells in the raster to dataframe function
+
+    Parameters
+    ----------
+    model_object: Model
+                Instance of Model class.
+    """
+
+    path = os.path.join("onstove", "tests", "tests_data", "RWA", "Demographics", "Population", "Population.tif")
+    model_object.add_layer(category="Demographics", name="Population", path=path, layer_type="raster",
+                           base_layer=True)
+    model_object.population_to_dataframe()
+
+    layer = RasterLayer(name="Surface")
+    rows, cols = np.indices(model_object.base_layer.data.shape)
+    layer.data = np.sin(rows / 5) + np.cos(cols / 7)
+    layer.meta = dict(model_object.base_layer.meta, nodata=np.nan)
+    missing = np.arange(len(model_object.rows)) % 4 == 0
+    layer.data[model_object.rows[missing], model_object.cols[missing]] = np.nan
+
+    expected = fillnodata(layer.data.copy(), mask=~np.isnan(layer.data), max_search_distance=100)
+    data = model_object.raster_to_dataframe(layer, method="read", fill_nodata_method="interpolate")
+    assert np.allclose(data, expected[model_object.rows, model_object.cols])
+
+    # the windows around the cells give the same values as filling the whole raster
+    rows, cols = model_object.rows[missing][::20], model_object.cols[missing][::20]
+    values = OnStove._interpolate_valid(layer.data, ~np.isnan(layer.data), rows, cols,
+                                        max_search_distance=10, block_size=16)
+    expected = fillnodata(layer.data.copy(), mask=~np.isnan(layer.data), max_search_distance=10)
+    assert np.allclose(values, expected[rows, cols], equal_nan=True)
+
+
+def test_raster_to_dataframe_batch(model_object):
+    """Test for extracting several layers at once with the raster to dataframe function
+
+    Parameters
+    ----------
+    model_object: Model
+                Instance of Model class.
+    """
+
+    path = os.path.join("onstove", "tests", "tests_data", "RWA", "Demographics", "Population", "Population.tif")
+    model_object.add_layer(category="Demographics", name="Population", path=path, layer_type="raster",
+                           base_layer=True)
+    model_object.population_to_dataframe()
+
+    surface = RasterLayer(name="Surface")
+    rows, cols = np.indices(model_object.base_layer.data.shape)
+    surface.data = np.sin(rows / 5) + np.cos(cols / 7)
+    surface.meta = dict(model_object.base_layer.meta, nodata=np.nan)
+    surface.data[model_object.rows[::4], model_object.cols[::4]] = np.nan
+    layers = {"Pop_read": model_object.base_layer, "Surface": surface}
+
+    model_object.raster_to_dataframe(layers, method="read", fill_nodata_method="interpolate")
+    for name, layer in layers.items():
+        expected = model_object.raster_to_dataframe(layer, method="read", fill_nodata_method="interpolate")
+        assert np.array_equal(model_object.gdf[name].values, expected)
+    assert not model_object.gdf["Surface"].isna().any()
+
+    # layers with another shape would be read at the wrong cells
+    padded = RasterLayer(name="Padded")
+    padded.data = np.pad(surface.data, ((0, 0), (0, 1)))
+    padded.meta = surface.meta
+    with pytest.raises(ValueError):
+        model_object.raster_to_dataframe({"Surface": surface, "Padded": padded}, method="read")
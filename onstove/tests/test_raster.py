@@ -1,14 +1,21 @@
 # tests for raster.py module
 import pytest
 import os
+import gzip
+import shutil
+import numpy as np
+import geopandas as gpd
+import rasterio
 from onstove.layer import VectorLayer, RasterLayer
 from onstove.raster import (
     align_raster,
+    decompress_raster,
     mask_raster,
     normalize,
     reproject_raster,
     merge_rasters,
-    resample
+    resample,
+    sample_raster
 )
 
 
@@ -171,6 +178,54 @@ def test_mask_raster(raster_path, vector_path, output_path):
     print(f"\noriginal raster: {os.stat(raster_path).st_size} bytes")
 
 
+def test_mask_raster_gzip(raster_path, vector_path, output_path):
+    """Test for mask raster function with a gzipped raster
+
+    Parameters
+    ----------
+    raster_path: str
+                Raster path.
+    vector_path: str
+                Vector path.
+    output_path: str
+                Output path
+    """
+
+    os.makedirs(output_path, exist_ok=True)
+    gz_path = os.path.join(output_path, "raster.tif.gz")
+    with open(raster_path, "rb") as src, gzip.open(gz_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    cache_dir = os.path.join(output_path, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    path = os.path.join(output_path, "masked_raster_gz.tif")
+    mask_raster(
+        raster_path=gz_path,
+        mask_layer=vector_path,
+        output_file=path,
+        cache_dir=cache_dir
+    )
+    assert os.path.exists(path)
+
+    cached_file = decompress_raster(gz_path, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(cached_file)]
+    with open(cached_file, "rb") as cached, open(raster_path, "rb") as original:
+        assert cached.read() == original.read()
+
+    # a modified input replaces its stale copy
+    os.utime(gz_path, ns=(0, 0))
+    updated_file = decompress_raster(gz_path, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(updated_file)]
+    assert updated_file != cached_file
+
+    # the least recently used files are removed when the cache is full
+    other_path = os.path.join(output_path, "other_raster.tif.gz")
+    shutil.copyfile(gz_path, other_path)
+    other_file = decompress_raster(other_path, cache_dir=cache_dir, max_size=os.path.getsize(updated_file))
+    assert os.listdir(cache_dir) == [os.path.basename(other_file)]
+    os.remove(other_path)
+
+
 def test_reproject_raster(raster_path):
     """Test for reproject raster function
 
@@ -224,6 +279,47 @@ def test_merge_rasters(sample_raster_layer_1, sample_raster_layer_2, output_path
     assert os.path.exists(output)
 
 
+def test_merge_rasters_vrt(output_path):
+    """Test for merge rasters function using a virtual raster
+
+    Parameters
+    ----------
+    output_path: str
+                Output path
+    """
+
+    path = os.path.join(
+        "onstove",
+        "tests",
+        "tests_data",
+        "raster*.tif"
+    )
+    merged = merge_rasters(
+        files_path=path,
+        dst_crs=3857,
+        outpul_file=os.path.join(output_path, "merged_raster_merge.tif")
+    )
+    streamed = merge_rasters(
+        files_path=path,
+        dst_crs=3857,
+        outpul_file=os.path.join(output_path, "merged_raster_vrt.tif"),
+        method="vrt"
+    )
+    vrt = merge_rasters(
+        files_path=path,
+        dst_crs=3857,
+        outpul_file=os.path.join(output_path, "merged_raster.vrt"),
+        method="vrt"
+    )
+    with rasterio.open(merged) as src:
+        expected = src.read(1)
+        transform = src.transform
+    for file in [streamed, vrt]:
+        with rasterio.open(file) as src:
+            assert src.transform == transform
+            assert np.array_equal(src.read(1), expected)
+
+
 def test_resample(sample_raster_layer, raster_path):
     """Test for align raster function
 
@@ -272,3 +368,25 @@ def test_normalize(raster_path, output_path):
     assert os.path.exists(output)
     normalized = RasterLayer(output)
     assert normalized.normalization == "MinMax"
+
+
+def test_sample_raster(sample_raster_layer, raster_path):
+    """Test for sample raster function
+
+    Parameters
+    ----------
+    sample_raster_layer: Raster Layer
+                Instance of Raster Layer class.
+                See :class:`onstove.RasterLayer`.
+    raster_path: str
+                Raster path
+    """
+
+    rows = np.array([0, 5, sample_raster_layer.meta["height"] - 1])
+    cols = np.array([0, 3, sample_raster_layer.meta["width"] - 1])
+    x, y = rasterio.transform.xy(sample_raster_layer.meta["transform"], rows, cols, offset="center")
+    gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs=sample_raster_layer.meta["crs"])
+
+    data = sample_raster(raster_path, gdf)
+    assert isinstance(data, np.ndarray)
+    assert np.allclose(data, sample_raster_layer.data[rows, cols])
@@ -25,11 +25,11 @@ data.add_mask_layer(category='Administrative', name='Country_boundaries',
 print(f'[{country}] Adding population')
 pop_path = snakemake.input.population
 data.add_layer(category='Demographics', name='Population', path=pop_path,
-               layer_type='raster', resample='sum')
+               layer_type='raster', resample='sum', lazy=True)
 
 ghs_path = snakemake.input.ghs
 data.add_layer(category='Demographics', name='Urban', path=ghs_path, layer_type='raster',
-               resample='nearest')
+               resample='nearest', lazy=True)
 
 # Biomass
 print(f'[{country}] Adding forest')
@@ -45,7 +45,7 @@ factor = (data.cell_size[0] ** 2) / (transform[0] ** 2)
 print(f'[{country}] Adding walking friction')
 friction_path = snakemake.input.walking_friction
 data.add_layer(category='Biomass', name='Friction', path=friction_path, layer_type='raster',
-               resample='average', window=True)
+               resample='average', window=True, lazy=True)
 
 # Electricity
 print(f'[{country}] Adding MV lines')
@@ -56,14 +56,14 @@ data.add_layer(category='Electricity', name='MV_lines', path=mv_path,
 print(f'[{country}] Adding Nighttime Lights')
 ntl_path = snakemake.input.ntl
 data.add_layer(category='Electricity', name='Night_time_lights', path=ntl_path, layer_type='raster',
-               resample='average', window=True)
+               resample='average', window=True, lazy=True)
 # data.layers['Electricity']['Night_time_lights'].save(f'{data.output_directory}/Electricity/Night_time_lights')
 
 # LPG
 print(f'[{country}] Adding traveltime to cities')
 traveltime_cities = snakemake.input.traveltime_cities
 data.add_layer(category='LPG', name='Traveltime', path=traveltime_cities,
-               layer_type='raster', resample='average', window=True)
+               layer_type='raster', resample='average', window=True, lazy=True)
 # data.layers['LPG']['Traveltime'].save(f'{data.output_directory}/LPG/Traveltime')
 
 print(f'[{country}] Adding roads')
@@ -75,7 +75,7 @@ data.add_layer(category='LPG', name='Roads', path=roads,
 print(f'[{country}] Adding temperature')
 temperature = snakemake.input.temperature
 data.add_layer(category='Biogas', name='Temperature', path=temperature,
-               layer_type='raster', resample='average', window=True)
+               layer_type='raster', resample='average', window=True, lazy=True)
 # data.layers['Biogas']['Temperature'].save(f'{data.output_directory}/Biogas/Temperature')
 # data.mask_layers(datasets={'Biogas': ['Temperature']})
 
@@ -95,7 +95,7 @@ for key, path in {'buffaloes': buffaloes,
              'pigs': pigs,
              'sheeps': sheeps}.items():
     data.add_layer(category='Biogas/Livestock', name=key, path=path,
-                   layer_type='raster', resample='nearest', window=True, rescale=True)
+                   layer_type='raster', resample='nearest', window=True, rescale=True, lazy=True)
 
 print(f'[{country}] Adding water scarcity')
 water = VectorLayer(category='Biogas', name='Water scarcity', path=snakemake.input.water, bbox=data.mask_layer.data)
@@ -105,10 +105,11 @@ water.data['class'] = np.where(water.data['bws_label'].isin(['Low (<10%)',
 water.data.to_crs(data.project_crs, inplace=True)
 out_folder = os.path.join(data.output_directory, "Biogas", "Water scarcity")
 water.rasterize(cell_height=data.cell_size[0], cell_width=data.cell_size[1],
-                attribute="class", output_path=out_folder, nodata=0)
+                attribute="class", output_path=out_folder, nodata=0,
+                tile_size=1024, workers=4)
 data.add_layer(category='Biogas', name='Water scarcity',
                path=os.path.join(out_folder, 'Water scarcity.tif'),
-               layer_type='raster', resample='nearest')
+               layer_type='raster', resample='nearest', lazy=True)
 
 # add base layer
 forest_path = snakemake.input.forest
@@ -134,4 +135,4 @@ data.layers['Biomass']['Forest'].meta['dtype'] = 'float32'
 print(f'[{country}] Masking all layers')
 data.mask_layers(datasets='all')
 
-data.save_datasets('all')
+data.save_datasets('all', vector_format='parquet')
@@ -54,4 +54,5 @@ for location in locations:
 
 if len(locations) > 1:
     print('   Merging rasters')
-    merge_rasters(os.path.join(out_folder, country, '*.tif'), 4326, os.path.join(out_folder, country, 'Forest.tif'))
+    merge_rasters(os.path.join(out_folder, country, '*.tif'), 4326, os.path.join(out_folder, country, 'Forest.tif'),
+                  method='vrt')
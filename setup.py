@@ -25,12 +25,13 @@ setup(
                               'tests/tests_data/RWA/*/*/*.*']},
     python_requires='>=3.10',
     install_requires=['dill',
-                      'geopandas',
+                      'geopandas>=1.0',
                       'jupyterlab',
                       'matplotlib',
                       'plotnine',
                       'psutil',
                       'psycopg2',
+                      'pyarrow',
                       'python-decouple',
                       'rasterio',
                       'scikit-image',
@@ -67,16 +67,16 @@ rule process_data:
           output_directory = "../Clean cooking Africa paper/06. Results/Processed data/{country}",
           country = "{country}"
     output:
-          mask_layer = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Administrative/Country_boundaries/Country_boundaries.geojson",
+          mask_layer = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Administrative/Country_boundaries/Country_boundaries.parquet",
           population = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Demographics/Population/Population.tif",
           ghs = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Demographics/Urban/Urban.tif",
           forest = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Biomass/Forest/Forest.tif",
           biomass_friction = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Biomass/Friction/Friction.tif",
           # hv_lines = "Africa/{country}/Electricity/HV_lines/HV_lines.geojson",
-          mv_lines = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Electricity/MV_lines/MV_lines.geojson",
+          mv_lines = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Electricity/MV_lines/MV_lines.parquet",
           ntl = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Electricity/Night_time_lights/Night_time_lights.tif",
           traveltime_cities = "../Clean cooking Africa paper/06. Results/Processed data/{country}/LPG/Traveltime/Traveltime.tif",
-          roads = "../Clean cooking Africa paper/06. Results/Processed data/{country}/LPG/Roads/roads.geojson",
+          roads = "../Clean cooking Africa paper/06. Results/Processed data/{country}/LPG/Roads/roads.parquet",
           temperature = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Biogas/Temperature/Temperature.tif",
           buffaloes = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Biogas/Livestock/buffaloes/buffaloes.tif",
           cattles = "../Clean cooking Africa paper/06. Results/Processed data/{country}/Biogas/Livestock/cattles/cattles.tif",